@@ -2,12 +2,14 @@
 # bm25_tuner.py — Adaptive, gradient-free hyperparameter search for BM25
 # Configure constants at the top; run:  python bm25_tuner.py
 #
-# It edits <INDEX_DIR>/bm25.json["hyperparams"] for (k1,b), calls your bm25()
-# to produce a TREC run, and evaluates macro/micro P/R/F1 using evaluate_ir.py.
+# It loads the index once, passes (k1,b) straight to bm25_with_params() to
+# produce a TREC run, and evaluates macro/micro P/R/F1 using evaluate_ir.py.
 #
 # No external libraries required.
 
-import os, sys, json, time, csv, random, math, shutil, datetime, traceback, importlib.util
+import os, sys, time, csv, random, math, shutil, datetime, traceback, importlib.util, statistics, pickle
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Dict, Any, Tuple
 
 # =========================
@@ -31,17 +33,32 @@ K1_LOW, K1_HIGH = 0.8, 1.4              # typical BM25 k1 range
 B_LOW, B_HIGH = 0.00, 0.40              # typical BM25 b range
 
 # Optimization settings
+SAMPLER = "local"                       # refinement proposals: "local" (steps around the best) or "tpe" (Parzen estimator over all trials)
 N_TRIALS = 120                          # total trials
 N_WARMUP = 30                           # random exploration trials before local refinement
 INIT_SIGMA = {"k": 1.0, "k1": 0.10, "b": 0.04}  # initial local step sizes
 SIGMA_DECAY_ON_IMPROVE = 0.85           # shrink step size when improvement found
 SIGMA_GROW_ON_STALL = 1.10              # slightly increase on stalls to escape local minima
 PATIENCE = 10                           # after these many non-improving trials, random restart
+TPE_GAMMA = 0.25                        # fraction of past trials treated as "good" by the TPE sampler
+TPE_N_CANDIDATES = 24                   # draws scored per TPE proposal
 SEED = 42                               # reproducibility
+N_WORKERS = os.cpu_count() or 1         # processes for the random warmup batch (1 = sequential)
+BATCH_SIZE = 8                          # max (k1,b) settings scored together by one bm25_batch pass
+REFINE_BATCH = 4                        # candidates proposed per refinement step (1 = strictly sequential)
 
 # Objective to maximize: one of {"macro_f1", "micro_f1", "macro_p", "micro_p", "macro_r", "micro_r"}
 METRIC = "macro_f1"
 
+# Refinement trials stop evaluating once the macro METRIC provably cannot beat the best.
+# Off by default: the BM25 run is done before evaluation starts, so pruning saves little,
+# and pruned trials are not written to the CSV, so neither the TPE sampler nor a resumed
+# sweep sees them. Has no effect for micro_* metrics.
+PRUNE_TRIALS = False
+
+# Write each trial's top-k run as a TREC file under RUNS_DIR (done on a background thread)
+LOG_RUN_FILES = True
+
 # CSV filename (will be created under OUTPUT_ROOT)
 CSV_NAME = "bm25_tuner_results_k20.2.csv"
 
@@ -49,7 +66,8 @@ CSV_NAME = "bm25_tuner_results_k20.2.csv"
 # ====== END CONFIG =======
 # =========================
 
-random.seed(SEED)
+# Private generator: draws stay reproducible whatever else touches the global `random` state
+_RNG = random.Random(SEED)
 
 os.makedirs(OUTPUT_ROOT, exist_ok=True)
 CSV_PATH = os.path.join(OUTPUT_ROOT, CSV_NAME)
@@ -71,20 +89,55 @@ bm25_mod = _import_from_path("bm25_retrieval", PATH_BM25_FILE)
 eval_mod = _import_from_path("evaluate_ir", PATH_EVAL_FILE)
 
 # Validate required callables
-assert hasattr(bm25_mod, "bm25"), "bm25_retrieval.py must expose bm25(queryFile, index_dir, stopword_file, k, outFile)"
+assert hasattr(bm25_mod, "bm25_return"), "bm25_retrieval.py must expose bm25_return(queryFile, index_dir, k, k1, b, index)"
+assert hasattr(bm25_mod, "bm25_batch"), "bm25_retrieval.py must expose bm25_batch(queryFile, index_dir, k, params_list, index)"
+assert hasattr(bm25_mod, "load_bm25_index"), "bm25_retrieval.py must expose load_bm25_index(index_dir)"
 assert hasattr(eval_mod, "load_qrels_jsonl"), "evaluate_ir.py must expose load_qrels_jsonl"
-assert hasattr(eval_mod, "load_run_trec"), "evaluate_ir.py must expose load_run_trec"
 assert hasattr(eval_mod, "evaluate"), "evaluate_ir.py must expose evaluate"
+assert hasattr(eval_mod, "evaluate_with_early_stop"), "evaluate_ir.py must expose evaluate_with_early_stop"
+assert hasattr(eval_mod, "write_trec_run"), "evaluate_ir.py must expose write_trec_run"
+
+def load_qrels_cached(path: str) -> Dict[str, frozenset]:
+    """Parsed qrels, pickled under OUTPUT_ROOT and reused while it is newer than the JSONL."""
+    src = os.path.abspath(path)
+    cache_path = os.path.join(OUTPUT_ROOT, os.path.basename(path) + ".pkl")
+    try:
+        if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            with open(cache_path, "rb") as f:
+                cached_src, qrels = pickle.load(f)
+            if cached_src == src:
+                # Unpickled strings are not interned; redo what load_qrels_jsonl does
+                return {sys.intern(qid): frozenset(map(sys.intern, docs)) for qid, docs in qrels.items()}
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+    qrels = {qid: frozenset(docs) for qid, docs in eval_mod.load_qrels_jsonl(path).items()}
+    try:
+        with open(cache_path, "wb") as f:
+            pickle.dump((src, qrels), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # read-only location: just parse again next time
+    return qrels
+
+# Read qrels and the BM25 index (index.json + bm25.json) once
+QRELS = load_qrels_cached(QRELS_JSONL)
+QRELS_QIDS = eval_mod.sort_qids(QRELS)     # qrels never change, so order them once
+INDEX = bm25_mod.load_bm25_index(INDEX_DIR)
 
-# Read qrels once
-QRELS = eval_mod.load_qrels_jsonl(QRELS_JSONL)
+METRIC_KEYS = ("macro_p", "macro_r", "macro_f1", "micro_p", "micro_r", "micro_f1")
+
+# In-memory memo of evaluate_once results: eval_key -> (metrics, run_path)
+_EVAL_CACHE: Dict[Tuple[int, float, float], Tuple[Dict[str, float], str]] = {}
+
+def eval_key(params: Dict[str, Any]) -> Tuple[int, float, float]:
+    """Quantize (k, k1, b) so float representation noise cannot defeat duplicate detection."""
+    return (int(params["k"]), round(float(params["k1"]), 4), round(float(params["b"]), 4))
 
 def clamp(v, lo, hi):
     return max(lo, min(hi, v))
 
 def trunc_norm(mean, sigma, lo, hi):
     # Sample from Normal(mean, sigma) and clamp to bounds
-    x = random.gauss(mean, sigma)
+    x = _RNG.gauss(mean, sigma)
     return clamp(x, lo, hi)
 
 def propose_candidate(best: Dict[str, Any], sigma: Dict[str, float]) -> Dict[str, Any]:
@@ -94,81 +147,215 @@ def propose_candidate(best: Dict[str, Any], sigma: Dict[str, float]) -> Dict[str
     b = trunc_norm(best["b"], sigma["b"], B_LOW, B_HIGH)
     return {"k": k, "k1": k1, "b": b}
 
+# (name, low, high) for every searched parameter
+SEARCH_DIMS = (("k", K_MIN, K_MAX), ("k1", K1_LOW, K1_HIGH), ("b", B_LOW, B_HIGH))
+
+def _parzen_density(x: Dict[str, Any], points: list, bws: Dict[str, float]) -> float:
+    """Equal-weight mixture of a uniform prior and one Gaussian per past point (fixed dims ignored)."""
+    dims = [(p, lo, hi) for p, lo, hi in SEARCH_DIMS if hi > lo]
+    prior = 1.0
+    for _, lo, hi in dims:
+        prior /= (hi - lo)
+    total = prior
+    for pt in points:
+        log_pdf = 0.0
+        for p, _, _ in dims:
+            z = (float(x[p]) - float(pt[p])) / bws[p]
+            log_pdf -= 0.5 * z * z + math.log(bws[p] * math.sqrt(2 * math.pi))
+        total += math.exp(log_pdf)
+    return total / (len(points) + 1)
+
+def _gauss_in_bounds(mean: float, sigma: float, lo: float, hi: float, tries: int = 8) -> float:
+    # Rejection-sample inside [lo, hi]; clamping would pile draws onto the bounds
+    for _ in range(tries):
+        x = _RNG.gauss(mean, sigma)
+        if lo <= x <= hi:
+            return x
+    return clamp(x, lo, hi)
+
+def _bandwidths(points: list) -> Dict[str, float]:
+    # Scott-style shrinkage: narrower kernels as the group grows
+    return {p: max(1e-3, (hi - lo) * max(1, len(points)) ** -0.2) for p, lo, hi in SEARCH_DIMS}
+
+def propose_candidate_tpe(history: list) -> Dict[str, Any]:
+    """
+    Tree-structured Parzen estimator proposal (what Optuna's TPESampler does, in plain Python).
+    history: past trial rows with k, k1, b and METRIC. The rows are split into the best
+    TPE_GAMMA fraction (l) and the rest (g); draws are sampled around good points and
+    the one maximizing l(x)/g(x) is returned.
+    """
+    ranked = sorted(history, key=lambda r: float(r[METRIC]), reverse=True)
+    n_good = max(1, int(math.ceil(TPE_GAMMA * len(ranked))))
+    good, bad = ranked[:n_good], ranked[n_good:]
+    bw_good, bw_bad = _bandwidths(good), _bandwidths(bad)
+
+    seen = {eval_key(r) for r in history}
+
+    best_cand, best_ratio = None, -1.0
+    for _ in range(TPE_N_CANDIDATES):
+        center = _RNG.choice(good)
+        cand = {p: _gauss_in_bounds(float(center[p]), bw_good[p], lo, hi) for p, lo, hi in SEARCH_DIMS}
+        cand["k"] = int(round(cand["k"]))
+        if eval_key(cand) in seen:
+            continue
+        ratio = _parzen_density(cand, good, bw_good) / _parzen_density(cand, bad, bw_bad)
+        if ratio > best_ratio:
+            best_cand, best_ratio = cand, ratio
+    # Every draw was already evaluated: let the caller's duplicate check resample
+    return best_cand if best_cand is not None else cand
+
 def random_candidate() -> Dict[str, Any]:
-    k = random.randint(K_MIN, K_MAX)
-    k1 = random.uniform(K1_LOW, K1_HIGH)
-    b = random.uniform(B_LOW, B_HIGH)
+    k = _RNG.randint(K_MIN, K_MAX)
+    k1 = _RNG.uniform(K1_LOW, K1_HIGH)
+    b = _RNG.uniform(B_LOW, B_HIGH)
     return {"k": k, "k1": k1, "b": b}
 
-def set_hyperparams_in_bm25(index_dir: str, k1: float, b: float) -> Dict[str, Any]:
-    """Edit <index_dir>/bm25.json to set hyperparams and return previous JSON (for restoration)."""
-    bm25_path = os.path.join(index_dir, "bm25.json")
-    with open(bm25_path, "r", encoding="utf-8") as f:
-        bm = json.load(f)
-    prev = json.dumps(bm)  # keep string backup to restore exactly
-
-    hp = bm.get("hyperparams", {})
-    hp["k1"] = float(k1)
-    hp["b"] = float(b)
-    bm["hyperparams"] = hp
-    with open(bm25_path, "w", encoding="utf-8") as f:
-        json.dump(bm, f, ensure_ascii=False, indent=2)
-    return {"path": bm25_path, "prev": prev}
-
-def restore_bm25(snapshot: Dict[str, Any]):
-    if not snapshot:
+# Run files are logging only, so their writes are kept off the trial loop
+_RUN_WRITER = ThreadPoolExecutor(max_workers=1) if LOG_RUN_FILES else None
+
+# Full top-K_MAX rankings per (k1, b): (k1, b) -> dict[qid] -> list of (docid, rank, score)
+_RUN_CACHE: Dict[Tuple[float, float], Dict[str, list]] = {}
+
+def _run_bm25_full(k1: float, b: float) -> Dict[str, list]:
+    """Run BM25 once at K_MAX for (k1, b); every k <= K_MAX is a prefix of this ranking."""
+    key = (round(k1, 6), round(b, 6))
+    if key in _RUN_CACHE:
+        return _RUN_CACHE[key]
+
+    run = bm25_mod.bm25_return(QUERIES_JSON, INDEX_DIR, int(K_MAX), k1=k1, b=b, index=INDEX)
+    _RUN_CACHE[key] = run
+    return run
+
+def _prefill_runs(cands: list):
+    """Fill _RUN_CACHE for all uncached (k1, b) in cands with a single bm25_batch pass."""
+    missing = []
+    for cand in cands:
+        key = (round(cand["k1"], 6), round(cand["b"], 6))
+        if key not in _RUN_CACHE and key not in missing:
+            missing.append(key)
+    if not missing:
         return
-    with open(snapshot["path"], "w", encoding="utf-8") as f:
-        f.write(snapshot["prev"])
+    runs = bm25_mod.bm25_batch(QUERIES_JSON, INDEX_DIR, int(K_MAX), missing, index=INDEX)
+    for key, run in zip(missing, runs):
+        _RUN_CACHE[key] = run
 
-def evaluate_once(params: Dict[str, Any], trial_id: int) -> Tuple[Dict[str, float], str]:
+def evaluate_once(params: Dict[str, Any], trial_id: int, log_async: bool = True,
+                  threshold: float = None) -> Tuple[Dict[str, float], str]:
     """
     Run bm25 with given params and evaluate. Returns (metrics, run_path).
     metrics keys: macro_p, macro_r, macro_f1, micro_p, micro_r, micro_f1
+    log_async=False writes the run file before returning (needed in pool workers,
+    which exit without draining _RUN_WRITER).
+    With a threshold (macro METRIC only) the evaluation may stop early; such a
+    pruned trial returns (None, "") and is neither logged nor memoized.
     """
+    key = eval_key(params)
+    if key in _EVAL_CACHE:
+        return _EVAL_CACHE[key]
     k, k1, b = params["k"], params["k1"], params["b"]
 
-    # Set BM25 hyperparameters in bm25.json (snapshot for safety)
-    snap = set_hyperparams_in_bm25(INDEX_DIR, k1, b)
-    try:
+    run = _run_bm25_full(k1, b)
+    top = {qid: ranked[:k] for qid, ranked in run.items()}  # ranks run 1..K_MAX in order
+
+    # top already holds top-k
+    if threshold is not None and METRIC.startswith("macro_"):
+        res = eval_mod.evaluate_with_early_stop(QRELS, top, threshold, metric=METRIC, sorted_qids=QRELS_QIDS)
+        if res is None:
+            return None, ""
+        per_query, macro_avg, micro_avg = res
+    else:
+        per_query, macro_avg, micro_avg = eval_mod.evaluate(QRELS, top, k=None, sorted_qids=QRELS_QIDS)
+    metrics = {
+        "macro_p": macro_avg[0], "macro_r": macro_avg[1], "macro_f1": macro_avg[2],
+        "micro_p": micro_avg[0], "micro_r": micro_avg[1], "micro_f1": micro_avg[2],
+    }
+
+    # The sliced TREC file is only written for logging; evaluation uses `top` directly
+    run_path = ""
+    if _RUN_WRITER is not None:
         run_path = os.path.join(RUNS_DIR, f"run_trial{trial_id}_k{k}_k1{round(k1,4)}_b{round(b,4)}.txt")
-        bm25_mod.bm25(QUERIES_JSON, INDEX_DIR, STOPWORDS_PATH, int(k), run_path)
-
-        # Evaluate
-        run = eval_mod.load_run_trec(run_path)
-        per_query, macro_avg, micro_avg = eval_mod.evaluate(QRELS, run, k=None)  # run already contains top-k
-        metrics = {
-            "macro_p": macro_avg[0], "macro_r": macro_avg[1], "macro_f1": macro_avg[2],
-            "micro_p": micro_avg[0], "micro_r": micro_avg[1], "micro_f1": micro_avg[2],
-        }
-        return metrics, run_path
-    finally:
-        # Restore bm25.json to previous content (avoid accumulating floating diffs)
-        restore_bm25(snap)
+        items = [(qid, d, r, s) for qid, ranked in top.items() for d, r, s in ranked]
+        if log_async:
+            _RUN_WRITER.submit(eval_mod.write_trec_run, run_path, items)
+        else:
+            eval_mod.write_trec_run(run_path, items)
+
+    _EVAL_CACHE[key] = (metrics, run_path)
+    return metrics, run_path
+
+def _evaluate_chunk(chunk: list, threshold: float = None) -> list:
+    """Pool entry point: one bm25_batch pass for the chunk, then (metrics, run_path, error_text) per job."""
+    try:
+        _prefill_runs([cand for cand, _ in chunk])
+    except Exception:
+        # Fall back to one BM25 run per candidate so errors are reported per trial,
+        # but keep the batch failure visible
+        print("[warn] bm25_batch failed; scoring candidates one by one:")
+        traceback.print_exc()
+    out = []
+    for cand, trial in chunk:
+        try:
+            metrics, run_path = evaluate_once(cand, trial_id=trial, log_async=False, threshold=threshold)
+            out.append((metrics, run_path, None))
+        except Exception:
+            out.append((None, None, traceback.format_exc()))
+    return out
+
+def _pool_context():
+    """Prefer fork where the platform has it (Linux/macOS), so workers inherit INDEX and
+    QRELS copy-on-write; elsewhere each worker loads them again when it imports this module."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def evaluate_batch(jobs: list, threshold: float = None, parallel: bool = False) -> list:
+    """Evaluate independent (cand, trial) jobs; results keep job order.
+    threshold is passed on to evaluate_once (pruned jobs come back with metrics None).
+    Jobs are split into chunks of at most BATCH_SIZE that each share one bm25_batch pass.
+    With parallel=True (the warmup batch) the chunks are spread over N_WORKERS worker
+    processes (see _pool_context); otherwise they run in-process,
+    so a refinement step is one bm25_batch pass and its runs stay in _RUN_CACHE.
+    Results are memoized here in the parent."""
+    n_workers = min(N_WORKERS, len(jobs)) if parallel else 1
+    size = min(BATCH_SIZE, max(1, math.ceil(len(jobs) / n_workers)))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    if n_workers > 1 and len(chunks) > 1:
+        # Called once, for the warmup, before _RUN_WRITER has started its thread
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks)),
+                                 mp_context=_pool_context()) as ex:
+            results = [r for part in ex.map(_evaluate_chunk, chunks, [threshold] * len(chunks)) for r in part]
+    else:
+        results = [r for chunk in chunks for r in _evaluate_chunk(chunk, threshold)]
+    for (cand, _), (metrics, run_path, err) in zip(jobs, results):
+        if metrics is not None:
+            _EVAL_CACHE[eval_key(cand)] = (metrics, run_path)
+    return results
+
+def warm_start_sigma(rows: list) -> Dict[str, float]:
+    """Step sizes from the spread of the top 10% past trials, so a resumed sweep starts
+    with the landscape it already knows instead of INIT_SIGMA."""
+    ranked = sorted(rows, key=lambda r: float(r[METRIC]), reverse=True)
+    top = ranked[:max(2, int(math.ceil(0.1 * len(ranked))))]
+    return {p: max(1e-3, statistics.pstdev(float(r[p]) for r in top)) for p in INIT_SIGMA}
 
 def obj_value(metrics: Dict[str, float]) -> float:
     return float(metrics[METRIC])
 
 def read_existing_csv(csv_path: str):
+    """Load past trials keyed by eval_key; also primes _EVAL_CACHE so warm restarts skip replays."""
     cache = {}
     if not os.path.exists(csv_path):
         return cache
     with open(csv_path, "r", newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
-            key = (int(row["k"]), float(row["k1"]), float(row["b"]))
+            key = eval_key(row)
             cache[key] = {k: (float(v) if k not in ("trial", "run_path", "ts") else v)
                           for k, v in row.items()}
+            metrics = {m: cache[key][m] for m in METRIC_KEYS}
+            _EVAL_CACHE[key] = (metrics, row["run_path"])
     return cache
 
-def append_to_csv(csv_path: str, header: list, row: Dict[str, Any]):
-    file_exists = os.path.exists(csv_path)
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(row)
-
 def main():
     print(f"[bm25_tuner] optimizing {METRIC} over k∈[{K_MIN},{K_MAX}], k1∈[{K1_LOW},{K1_HIGH}], b∈[{B_LOW},{B_HIGH}]")
     cache = read_existing_csv(CSV_PATH)
@@ -196,37 +383,17 @@ def main():
     sigma = INIT_SIGMA.copy()
     non_improve = 0
 
-    trial_idx = 0
-    # We ensure N_TRIALS fresh evaluations (skip duplicates if they occur)
-    while trial_idx < N_TRIALS:
-        trial = trial_idx + 1
-        # Choose candidate
-        if trial <= N_WARMUP or best is None or (non_improve >= PATIENCE and random.random() < 0.6):
-            cand = random_candidate()
-            if non_improve >= PATIENCE:
-                # small "restart" near a random point by resetting sigmas
-                sigma = INIT_SIGMA.copy()
-                non_improve = 0
-        else:
-            cand = propose_candidate(best, sigma)
-
-        key = (cand["k"], round(cand["k1"], 6), round(cand["b"], 6))
-        if key in cache:
-            # Already computed—skip without advancing trial index
-            print(f"[skip] duplicate candidate {key}; resampling")
-            continue
-
-        print(f"[trial {trial}/{N_TRIALS}] k={cand['k']} k1={cand['k1']:.4f} b={cand['b']:.4f} ...")
-        try:
-            metrics, run_path = evaluate_once(cand, trial_id=trial)
-        except Exception as e:
-            print("[error] trial failed:", e)
-            traceback.print_exc()
-            # count as a trial to avoid infinite loops on persistent errors
-            trial_idx += 1
-            continue
-
-        # Log row
+    # Warm start: with at least N_WARMUP past trials the random phase adds little,
+    # so go straight to refinement around the known best
+    n_warmup = N_WARMUP
+    if len(cache) >= N_WARMUP:
+        n_warmup = 0
+        sigma = warm_start_sigma(list(cache.values()))
+        print(f"[resume] {len(cache)} past trials >= N_WARMUP; skipping warmup, σ → {sigma}")
+
+    def record(trial: int, cand: Dict[str, Any], metrics: Dict[str, float], run_path: str):
+        """Log one finished trial to the CSV and update best / step sizes."""
+        nonlocal best, best_val, sigma, non_improve
         ts = datetime.datetime.now().isoformat(timespec="seconds")
         row = {
             "trial": trial, "ts": ts,
@@ -235,8 +402,9 @@ def main():
             "micro_p": metrics["micro_p"], "micro_r": metrics["micro_r"], "micro_f1": metrics["micro_f1"],
             "run_path": run_path,
         }
-        append_to_csv(CSV_PATH, header, row)
-        cache[(row["k"], row["k1"], row["b"])] = row
+        writer.writerow(row)
+        csv_f.flush()  # keep every finished trial on disk in case the sweep dies
+        cache[eval_key(cand)] = row
 
         val = obj_value(metrics)
         improved = val > best_val
@@ -248,11 +416,98 @@ def main():
             sigma = {p: max(1e-3, s * SIGMA_DECAY_ON_IMPROVE) for p, s in sigma.items()}
             print(f"  ↳ improved {METRIC} = {best_val:.4f}; new best {best}; shrink σ → {sigma}")
         else:
-            non_improve += 1
-            # mild expansion encourages exploration
-            sigma = {p: min(999.0, s * SIGMA_GROW_ON_STALL) for p, s in sigma.items()}
-            print(f"  ↳ no improvement (streak={non_improve}); expand σ → {sigma}")
-        trial_idx += 1
+            stall()
+
+    def stall():
+        """Count a non-improving trial and widen the step sizes."""
+        nonlocal sigma, non_improve
+        non_improve += 1
+        # mild expansion encourages exploration
+        sigma = {p: min(999.0, s * SIGMA_GROW_ON_STALL) for p, s in sigma.items()}
+        print(f"  ↳ no improvement (streak={non_improve}); expand σ → {sigma}")
+
+    # One CSV handle for the whole sweep; rows are flushed as they are written
+    csv_f = open(CSV_PATH, "a", newline="", encoding="utf-8")
+    writer = csv.DictWriter(csv_f, fieldnames=header)
+    if csv_f.tell() == 0:
+        writer.writeheader()
+    try:
+        # Warmup: random candidates do not depend on earlier results, so draw them all
+        # up front and evaluate them as one (parallel) batch. Results are then recorded
+        # in trial order, which keeps the CSV identical to a sequential sweep.
+        warmup = []
+        pending = set()
+        while len(warmup) < min(n_warmup, N_TRIALS):
+            cand = random_candidate()
+            key = eval_key(cand)
+            if key in cache or key in _EVAL_CACHE or key in pending:
+                print(f"[skip] duplicate candidate {key}; resampling")
+                continue
+            pending.add(key)
+            warmup.append((cand, len(warmup) + 1))
+
+        if warmup:
+            print(f"[warmup] evaluating {len(warmup)} random candidates with {min(N_WORKERS, len(warmup))} worker(s)")
+        for (cand, trial), (metrics, run_path, err) in zip(warmup, evaluate_batch(warmup, parallel=True)):
+            if non_improve >= PATIENCE:
+                # small "restart" near a random point by resetting sigmas
+                sigma = INIT_SIGMA.copy()
+                non_improve = 0
+            print(f"[trial {trial}/{N_TRIALS}] k={cand['k']} k1={cand['k1']:.4f} b={cand['b']:.4f} ...")
+            if err is not None:
+                print("[error] trial failed:")
+                print(err)
+            else:
+                record(trial, cand, metrics, run_path)
+
+        # Local refinement: each step proposes up to REFINE_BATCH candidates around the
+        # current best; they share one in-process bm25_batch pass and are recorded in order
+        trial_idx = len(warmup)
+        pruned = set()  # eval_keys of pruned trials (not in the CSV, so tracked here)
+        # We ensure N_TRIALS fresh evaluations (skip duplicates if they occur)
+        while trial_idx < N_TRIALS:
+            jobs = []
+            pending = set()
+            while len(jobs) < min(REFINE_BATCH, N_TRIALS - trial_idx):
+                # Choose candidate
+                if best is None or (non_improve >= PATIENCE and _RNG.random() < 0.6):
+                    cand = random_candidate()
+                    if non_improve >= PATIENCE:
+                        # small "restart" near a random point by resetting sigmas
+                        sigma = INIT_SIGMA.copy()
+                        non_improve = 0
+                elif SAMPLER == "tpe":
+                    cand = propose_candidate_tpe(list(cache.values()))
+                else:
+                    cand = propose_candidate(best, sigma)
+
+                key = eval_key(cand)
+                if key in cache or key in _EVAL_CACHE or key in pending or key in pruned:
+                    # Already computed—skip without advancing trial index
+                    print(f"[skip] duplicate candidate {key}; resampling")
+                    continue
+                pending.add(key)
+                jobs.append((cand, trial_idx + len(jobs) + 1))
+
+            # Candidates that provably cannot beat the current best stop evaluating early
+            threshold = best_val - 1e-4 if PRUNE_TRIALS and best is not None else None
+            for (cand, trial), (metrics, run_path, err) in zip(jobs, evaluate_batch(jobs, threshold)):
+                print(f"[trial {trial}/{N_TRIALS}] k={cand['k']} k1={cand['k1']:.4f} b={cand['b']:.4f} ...")
+                if err is not None:
+                    # counted as a trial to avoid infinite loops on persistent errors
+                    print("[error] trial failed:")
+                    print(err)
+                elif metrics is None:
+                    print(f"  ↳ pruned: {METRIC} cannot reach best {best_val:.4f}")
+                    pruned.add(eval_key(cand))
+                    stall()
+                else:
+                    record(trial, cand, metrics, run_path)
+            trial_idx += len(jobs)
+    finally:
+        csv_f.close()
+        if _RUN_WRITER is not None:
+            _RUN_WRITER.shutdown(wait=True)
 
     # Print best summary
     print("\n=== BEST SETTINGS ===")
@@ -7,92 +7,81 @@
 # python Scoring/evaluate_ir.py --qrels Scoring/qrels.json --run temp/output/bm25_docids.txt
 
 import argparse
+import codecs
+import sys
 import json
 from collections import defaultdict
+from operator import itemgetter
+
+def _read_text(path):
+    """
+    Read a whole file, as UTF-16 when it starts with a UTF-16 BOM, else as UTF-8.
+    BOM-less UTF-16 fails the UTF-8 decode or decodes to text full of NULs, so
+    those files are read as UTF-16 after all.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return data.decode("utf-16")
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = None
+    if text is None or "\x00" in text:
+        # ASCII text in UTF-16 has its NUL byte first in big-endian order
+        return data.decode("utf-16-be" if data[:1] == b"\x00" else "utf-16-le")
+    return text
 
 def load_qrels_jsonl(path):
     """Load qrels from JSONL; return dict[qid] -> set of relevant doc_ids (relevance > 0)."""
     rel = defaultdict(set)
-    try:
-        with open(path, "r", encoding="utf-16") as f:
-            for line in f:
-                line = line.strip()
-                if not line: 
-                    continue
-                obj = json.loads(line)
-                qid = str(obj["query_id"]).strip()
-                doc = str(obj["doc_id"]).strip()
-                rel_val = int(obj.get("relevance", 0))
-                if rel_val > 0:
-                    rel[qid].add(doc)
-    except UnicodeError:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line: 
-                    continue
-                obj = json.loads(line)
-                qid = str(obj["query_id"]).strip()
-                doc = str(obj["doc_id"]).strip()
-                rel_val = int(obj.get("relevance", 0))
-                if rel_val > 0:
-                    rel[qid].add(doc)
+    loads = json.loads
+    for line in _read_text(path).splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        obj = loads(line)
+        # ids are interned here and in load_run_trec, so relset lookups of a
+        # run's docids end in an identity check rather than a string compare
+        qid = sys.intern(str(obj["query_id"]).strip())
+        doc = sys.intern(str(obj["doc_id"]).strip())
+        rel_val = int(obj.get("relevance", 0))
+        if rel_val > 0:
+            rel[qid].add(doc)
     return rel
 
-def load_run_trec(path):
+def load_run_trec(path, docids_only=False):
     """
     Load run in TREC format:
       qid docid rank score
     Return dict[qid] -> list of (docid, rank, score), sorted by rank asc.
+    With docids_only=True return dict[qid] -> list of docids in rank order instead
+    (all evaluate() needs; no per-row tuples are kept).
+    The file is read and decoded in one call, then parsed from the in-memory lines.
     """
     run = defaultdict(list)
-    try:
-        with open(path, "r", encoding="utf-16") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) < 4:
-                    # allow optional extra columns but require at least 4
-                    raise ValueError(f"Bad run line (need at least 4 fields): {line}")
-                qid, docid, rank_str, score_str = parts[:4]
-                try:
-                    rank = int(rank_str)
-                except ValueError:
-                    # Some runs use an extra column before rank. Try to parse last two as rank/score
-                    # but keep strictness for this assignment.
-                    raise
-                try:
-                    score = float(score_str)
-                except ValueError:
-                    score = 0.0
-                run[qid].append((docid, rank, score))
-    except UnicodeError:
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) < 4:
-                    # allow optional extra columns but require at least 4
-                    raise ValueError(f"Bad run line (need at least 4 fields): {line}")
-                qid, docid, rank_str, score_str = parts[:4]
-                try:
-                    rank = int(rank_str)
-                except ValueError:
-                    # Some runs use an extra column before rank. Try to parse last two as rank/score
-                    # but keep strictness for this assignment.
-                    raise
-                try:
-                    score = float(score_str)
-                except ValueError:
-                    score = 0.0
-                run[qid].append((docid, rank, score))
+    for line in _read_text(path).splitlines():
+        parts = line.split()
+        if not parts or parts[0].startswith("#"):
+            continue
+        if len(parts) < 4:
+            # allow optional extra columns but require at least 4
+            raise ValueError(f"Bad run line (need at least 4 fields): {line.strip()}")
+        qid, docid, rank_str, score_str = parts[:4]
+        qid = sys.intern(qid)
+        docid = sys.intern(docid)
+        # strict: a non-integer rank raises ValueError
+        rank = int(rank_str)
+        try:
+            score = float(score_str)
+        except ValueError:
+            score = 0.0
+        run[qid].append((docid, rank, score))
     # sort by rank
     for q in run:
-        run[q].sort(key=lambda t: t[1])
+        run[q].sort(key=itemgetter(1))
+    if docids_only:
+        return {q: [d for d, _, _ in ranked] for q, ranked in run.items()}
     return run
 
 def precision_recall_f1(num_rel_ret, num_ret, num_rel):
@@ -101,35 +90,73 @@ def precision_recall_f1(num_rel_ret, num_ret, num_rel):
     f1 = (2 * p * r / (p + r)) if (p + r) > 0 else 0.0
     return p, r, f1
 
-def evaluate(qrels, run, k=None):
+def sort_qids(qids):
+    """Report order for qids: shorter ids first, then lexicographic (so "2" < "10")."""
+    return sorted(qids, key=lambda x: (len(x), x))
+
+def evaluate(qrels, run, k=None, sorted_qids=None):
     """
     qrels: dict[qid] -> set(relevant docids)
-    run:   dict[qid] -> list of (docid, rank, score)
+    run:   dict[qid] -> list of (docid, rank, score), or list of docids in rank order
     k:     optional cutoff (use only top-k retrieved per query)
+    sorted_qids: optional sort_qids(qrels), computed once by callers that evaluate
+                 many runs against the same qrels; ignored if run adds qids
     Returns:
       per_query: dict[qid] -> (P, R, F1, num_ret, num_rel_ret, num_rel)
       macro_avg: (P_macro, R_macro, F1_macro)
       micro_avg: (P_micro, R_micro, F1_micro)
     """
+    return _evaluate(qrels, run, k, sorted_qids, None, None)
+
+# Position of each macro metric inside a per_query tuple
+_MACRO_FIELD = {"macro_p": 0, "macro_r": 1, "macro_f1": 2}
+
+def evaluate_with_early_stop(qrels, run, threshold, metric="macro_f1", k=None, sorted_qids=None):
+    """
+    Like evaluate(), but gives up and returns None as soon as `metric` (one of
+    macro_p / macro_r / macro_f1) can no longer reach `threshold`. Per-query values
+    are at most 1, so after n of Q queries the best reachable macro average is
+    (sum_so_far + Q - n) / Q. Micro metrics need every count and cannot stop early.
+    """
+    if metric not in _MACRO_FIELD:
+        raise ValueError(f"early stop needs a macro metric, got {metric!r}")
+    return _evaluate(qrels, run, k, sorted_qids, threshold, _MACRO_FIELD[metric])
+
+def _evaluate(qrels, run, k, sorted_qids, stop_below, stop_field):
+    """Shared body of evaluate() / evaluate_with_early_stop(); stop_below=None never stops."""
     per_query = {}
     all_qids = set(qrels.keys()) | set(run.keys())
+    n_total = len(all_qids)
+    running = 0.0
 
     # Micro counts
     micro_tp = micro_ret = micro_rel = 0
 
-    for qid in sorted(all_qids, key=lambda x: (len(x), x)):
+    # sorted_qids lists qrels' qids, so equal size means run brought no new ones
+    if sorted_qids is None or len(sorted_qids) != len(all_qids):
+        sorted_qids = sort_qids(all_qids)
+
+    for qid in sorted_qids:
         relset = qrels.get(qid, set())
         retrieved = run.get(qid, [])
         if k is not None:
             retrieved = retrieved[:k]
-        ret_docs = [d for (d, _, _) in retrieved]
+        if retrieved and isinstance(retrieved[0], str):
+            ret_docs = retrieved
+        else:
+            ret_docs = [d for (d, _, _) in retrieved]
 
         num_rel = len(relset)
         num_ret = len(ret_docs)
-        num_rel_ret = sum(1 for d in ret_docs if d in relset)
+        # map() over the bound set method keeps the membership scan in C
+        num_rel_ret = sum(map(relset.__contains__, ret_docs))
 
         P, R, F1 = precision_recall_f1(num_rel_ret, num_ret, num_rel)
         per_query[qid] = (P, R, F1, num_ret, num_rel_ret, num_rel)
+        if stop_below is not None:
+            running += per_query[qid][stop_field]
+            if (running + (n_total - len(per_query))) / n_total < stop_below:
+                return None
 
         micro_tp += num_rel_ret
         micro_ret += num_ret
@@ -176,7 +203,7 @@ def main():
     args = ap.parse_args()
 
     qrels = load_qrels_jsonl(args.qrels)
-    run = load_run_trec(args.run)
+    run = load_run_trec(args.run, docids_only=True)
     per_query, macro_avg, micro_avg = evaluate(qrels, run, k=args.k)
     print_report(per_query, macro_avg, micro_avg)
 
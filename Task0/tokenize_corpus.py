@@ -14,6 +14,9 @@ Usage: python3 tokenize_corpus.py <CORPUS_DIR_OR_FILE> <PATH_OF_STOPWORD_FILE> <
 import os
 import sys
 import json
+import hashlib
+from array import array
+import multiprocessing
 from typing import Iterable, Set
 from pathlib import Path
 
@@ -25,16 +28,25 @@ import argparse
 # Fields to concatenate for tokenization
 SELECT_FIELDS = ["title", "doi", "date", "abstract"]
 
+# nlp.pipe settings: texts per batch and worker processes (1 = tokenize in-process,
+# the default; VOCAB_PROCESSES already parallelizes across corpus files).
+# Override through the environment
+PIPE_BATCH_SIZE = int(os.environ.get("PIPE_BATCH_SIZE", "512"))
+PIPE_N_PROCESS = int(os.environ.get("PIPE_N_PROCESS", "1"))
+# Worker processes that each build the vocabulary of whole corpus files (1 = off)
+VOCAB_PROCESSES = int(os.environ.get("VOCAB_PROCESSES", str(os.cpu_count() or 1)))
+
 def _iter_paths(corpus_path: str):
     """
     Yield files to read, in lexicographic order for deterministic behavior.
     (Your A1 code iterated directory entries; we sort them here to avoid any nondeterminism.)
     """
     if os.path.isdir(corpus_path):
-        for name in sorted(os.listdir(corpus_path)):
-            p = os.path.join(corpus_path, name)
-            if os.path.isfile(p):
-                yield p
+        # scandir's DirEntry.is_file() uses the d_type from the directory read (no stat per entry)
+        with os.scandir(corpus_path) as it:
+            entries = sorted((e for e in it if e.is_file()), key=lambda e: e.name)
+        for e in entries:
+            yield e.path
     elif os.path.isfile(corpus_path):
         yield corpus_path
 
@@ -61,15 +73,6 @@ def _pick_text(doc: dict) -> str:
             parts.append(str(v))
     return " ".join(parts)
 
-def _tokenize_spacy_raw(nlp, text: str):
-    """Pure spaCy tokenization. Skips only whitespace tokens."""
-    doc = nlp(text)
-    for tok in doc:
-        if tok.is_space:
-            continue
-        yield tok.text
-
-
 def _read_jsonlines(path: str):
     """Yield JSON objects from a JSON-lines/NDJSON file, skipping malformed lines."""
     with open(path, "r", encoding="utf-8") as f:
@@ -82,19 +85,16 @@ def _read_jsonlines(path: str):
             except json.JSONDecodeError:
                 continue
 
-def build_vocab(corpus_path: str, vocab_dir: str) -> None:
-    os.makedirs(vocab_dir, exist_ok=True)
-    vocab: Set[str] = set()
+def _iter_texts(corpus_path: str):
+    """
+    Yield the text of every document that still needs tokenizing, in corpus order.
+    Documents whose doc_id was already seen are dropped, and so are texts identical to
+    one already yielded (compared by blake2b digest): the vocabulary is a set union,
+    so an identical text (shared boilerplate, same title/abstract under another id)
+    adds nothing.
+    """
     seen_doc_ids: Set[str] = set()
-
-    # spaCy tokenizer setup (parser/NER not needed)
-    try:
-        nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
-    except Exception:
-        print("Had to switch to ultra-fallback tokenizer")
-        nlp = spacy.blank("xx")  # fallback, but "en" is expected
-    nlp.max_length = 300_000_000
-
+    seen_texts: Set[bytes] = set()
     for fp in _iter_paths(corpus_path):
         # Expect NDJSON (same as A1); if it is a single large JSON, users can pipe/convert beforehand.
         for doc in _read_jsonlines(fp):
@@ -107,9 +107,116 @@ def build_vocab(corpus_path: str, vocab_dir: str) -> None:
             text = _pick_text(doc)
             if not text:
                 continue
+            h = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            if h in seen_texts:
+                continue
+            seen_texts.add(h)
+            yield text
+
+_NLP = None
+
+def _init_tokenizer():
+    """spaCy tokenizer setup (parser/NER not needed), built once per process."""
+    global _NLP
+    if _NLP is None:
+        try:
+            nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
+        except Exception:
+            print("Had to switch to ultra-fallback tokenizer")
+            nlp = spacy.blank("xx")  # fallback, but "en" is expected
+        nlp.max_length = 300_000_000
+        _NLP = nlp
+    return _NLP
+
+def _vocab_for_file(path: str):
+    """
+    Pool task: tokenize one corpus file. Returns (tokens, records) where tokens is
+    the file's distinct token list and records holds one (doc_id, array of indices
+    into tokens) per document kept after in-file doc_id dedupe. The parent applies
+    the cross-file doc_id dedupe, so per-document token sets are kept until then.
+    A text identical to an earlier one in the file shares that document's indices
+    instead of being tokenized again.
+    """
+    records = []
+    by_hash = {}   # text digest -> index of the record that tokenized it
+    aliases = []   # (record index, record index whose tokens it shares)
+    seen_doc_ids: Set[str] = set()
+
+    def texts():
+        for doc in _read_jsonlines(path):
+            doc_id = doc.get("doc_id")
+            if doc_id:
+                if doc_id in seen_doc_ids:
+                    continue
+                seen_doc_ids.add(doc_id)
+            r = len(records)
+            records.append((doc_id, array("i")))
+            text = _pick_text(doc)
+            if not text:
+                continue
+            h = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+            first = by_hash.get(h)
+            if first is not None:
+                aliases.append((r, first))
+                continue
+            by_hash[h] = r
+            yield text, r
+
+    local = {}
+    for doc, r in _init_tokenizer().pipe(texts(), as_tuples=True, batch_size=PIPE_BATCH_SIZE):
+        idxs = records[r][1]
+        for text in {tok.text for tok in doc}:
+            i = local.get(text)
+            if i is None:
+                i = local[text] = len(local)
+            idxs.append(i)
+    for r, first in aliases:
+        records[r] = (records[r][0], records[first][1])
+    return list(local), records
+
+def _pool_context():
+    """
+    Prefer fork where the platform has it (Linux/macOS): the parent builds the
+    tokenizer first and the workers inherit it copy-on-write instead of each
+    loading spaCy again. Elsewhere workers fall back to loading it on first use.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
 
-            for t in _tokenize_spacy_raw(nlp, text):
-                vocab.add(t)
+def _build_vocab_parallel(paths: list) -> Set[str]:
+    """Vocabulary of `paths` built file-parallel, with _iter_texts' first-wins doc_id dedupe."""
+    vocab: Set[str] = set()
+    seen_doc_ids: Set[str] = set()
+    _init_tokenizer()  # inherited by forked workers
+    with _pool_context().Pool(processes=min(VOCAB_PROCESSES, len(paths))) as pool:
+        # imap keeps corpus order, so the first file holding a doc_id wins as in _iter_texts
+        for tokens, records in pool.imap(_vocab_for_file, paths):
+            used = set()
+            for doc_id, idxs in records:
+                if doc_id:
+                    if doc_id in seen_doc_ids:
+                        continue
+                    seen_doc_ids.add(doc_id)
+                used.update(idxs)
+            vocab.update(map(tokens.__getitem__, used))
+    return vocab
+
+def build_vocab(corpus_path: str, vocab_dir: str) -> None:
+    os.makedirs(vocab_dir, exist_ok=True)
+    vocab: Set[str] = set()
+
+    paths = list(_iter_paths(corpus_path))
+    if VOCAB_PROCESSES > 1 and len(paths) > 1:
+        vocab = _build_vocab_parallel(paths)
+    else:
+        nlp = _init_tokenizer()
+        # Batched tokenization; with PIPE_N_PROCESS > 1 spaCy fans batches out to worker processes
+        for doc in nlp.pipe(_iter_texts(corpus_path), batch_size=PIPE_BATCH_SIZE, n_process=PIPE_N_PROCESS):
+            vocab.update([tok.text for tok in doc])
+    # Whitespace tokens are dropped once here rather than per token
+    # (Token.is_space is str.isspace() on the token text)
+    vocab.difference_update([t for t in vocab if t.isspace()])
 
     out_path = os.path.join(vocab_dir, "vocab.txt")
     with open(out_path, "w", encoding="utf-8") as out:
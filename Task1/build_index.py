@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 import os
 import sys
+import gc
 import json
+import hashlib
 import math
+import mmap
+import queue
+import threading
+from array import array
 from collections import defaultdict
+from functools import partial
+from itertools import groupby
+import multiprocessing
 from typing import Optional
 
 # Fast tokenizer (no spaCy model needed)
@@ -14,17 +23,37 @@ except ImportError as e:
         "spaCy is required. Install with:\n  pip install spacy"
     ) from e
 
+# nlp.pipe settings for build_index; override through the environment
+TOKENIZE_BATCH_SIZE = int(os.environ.get("TOKENIZE_BATCH_SIZE", "1000"))
+# spaCy worker processes for a serial build (1 = in-process); BUILD_PROCESSES already
+# parallelizes across corpus files
+TOKENIZE_PROCESSES = int(os.environ.get("TOKENIZE_PROCESSES", "1"))
+# Worker processes for indexing several corpus files at once (1 = single process)
+BUILD_PROCESSES = int(os.environ.get("BUILD_PROCESSES", str(os.cpu_count() or 1)))
+# First bytes of the binary sidecars, followed by the meta length (see _write_sidecar)
+BM25_MAGIC = b"A2BM25\x00\x01"
+VSM_MAGIC = b"A2VSM\x00\x00\x01"
+
 
 class InvertedIndex:
     """
-    postings: dict[int -> dict[int -> {"tf": int, "positions": list[int]}]]
-        term_id -> { doc_internal_id: {"tf": TF, "positions": [...]} }
+    Postings are kept per term_id as parallel int arrays (CSR style) rather than one
+    dict per (term, doc):
+        doc_ids[tid]     -> array('i') internal doc ids, ascending (insertion order)
+        tfs[tid]         -> array('i') term frequency of each posting
+        positions[tid]   -> array('i') all positions of the term, posting after posting
+        pos_offsets[tid] -> array('i') len(postings)+1 offsets; posting k's positions
+                            are positions[tid][pos_offsets[tid][k]:pos_offsets[tid][k+1]]
+    Use add_posting() / iter_postings() rather than touching the arrays directly.
 
     token2id/id2token and doc2id/id2doc are build-time helpers and are not
     serialized to index.json for Task-1.
     """
     def __init__(self):
-        self.postings = defaultdict(dict)   # term_id -> {doc_i: {"tf": int, "positions": list[int]}}
+        self.doc_ids = defaultdict(partial(array, "i"))         # term_id -> array of doc_i
+        self.tfs = defaultdict(partial(array, "i"))             # term_id -> array of tf
+        self.positions = defaultdict(partial(array, "i"))       # term_id -> concatenated positions
+        self.pos_offsets = defaultdict(partial(array, "i", [0]))  # term_id -> CSR offsets into positions
         self.token2id = {}                  # token -> term_id
         self.id2token = []                  # term_id -> token
         self.doc2id = {}                    # ext_doc_id -> internal int id
@@ -32,14 +61,40 @@ class InvertedIndex:
         # For BM25 stats
         self.doc_len = {}                   # ext_doc_id -> int (token count post-tokenization)
 
+    def add_posting(self, tid: int, did: int, positions) -> None:
+        """Append doc `did` with its sorted `positions` to term `tid`'s postings."""
+        self.doc_ids[tid].append(did)
+        self.tfs[tid].append(len(positions))
+        pos_arr = self.positions[tid]
+        pos_arr.extend(positions)
+        self.pos_offsets[tid].append(len(pos_arr))
+
+    def term_ids(self):
+        """Term ids that have at least one posting."""
+        return self.doc_ids.keys()
+
+    def df(self, tid: int) -> int:
+        return len(self.doc_ids[tid])
+
+    def iter_postings(self, tid: int):
+        """Yield (doc_i, tf, positions array slice) for term `tid` in insertion order."""
+        pos_arr = self.positions[tid]
+        offs = self.pos_offsets[tid]
+        for k, (did, tf) in enumerate(zip(self.doc_ids[tid], self.tfs[tid])):
+            yield did, tf, pos_arr[offs[k]:offs[k + 1]]
+
     def load_vocab(self, vocab_path: str):
+        # One read, then bulk passes. Split on "\n" only: str.splitlines() would also
+        # break tokens that contain characters such as \x85 or \u2028.
         with open(vocab_path, "r", encoding="utf-8") as f:
-            for line in f:
-                token = line.strip()
-                if token:
-                    tid = len(self.id2token)
-                    self.id2token.append(token)
-                    self.token2id[token] = tid
+            lines = f.read().split("\n")
+        # Tokens are interned: the strings are shared with every other interned copy
+        # (e.g. the same tokens loaded again by a pool worker's vocab or by later lookups)
+        self.id2token = [sys.intern(t) for t in map(str.strip, lines) if t]
+        # Term ids follow token order, so save_index can walk ids instead of sorting
+        # (Task-0 writes vocab.txt sorted already, which makes this sort linear)
+        self.id2token.sort()
+        self.token2id = {t: i for i, t in enumerate(self.id2token)}
 
     def assign_doc_id(self, ext_doc_id: str) -> int:
         if ext_doc_id in self.doc2id:
@@ -50,27 +105,219 @@ class InvertedIndex:
         return did
 
 
+# One tokenizer per process, created on first use (see _init_tokenizer)
+_NLP = None
+_NLP_LOCK = threading.Lock()
+
 def _init_tokenizer():
     """
     Fast tokenizer using spaCy's blank English tokenizer.
     Much faster than loading full models like en_core_web_sm.
+    The instance is cached per process; forked pool workers inherit it if the
+    parent already built one, otherwise their initializer builds it once.
     """
-    nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
-    nlp.max_length = 300_000_000  # allow very large inputs safely
-    return nlp
+    global _NLP
+    with _NLP_LOCK:
+        if _NLP is None:
+            # blank("en") has no tagger/parser/NER to disable: the tokenizer is all it runs
+            nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
+            nlp.max_length = 300_000_000  # allow very large inputs safely
+            _NLP = nlp
+        return _NLP
+
+def _corpus_files(corpus_dir: str) -> list:
+    """Corpus files in directory order."""
+    paths = []
+    for fname in os.listdir(corpus_dir):
+        path = os.path.join(corpus_dir, fname)
+        if os.path.isfile(path):
+            paths.append(path)
+    return paths
 
-def _tokenize_spacy_raw(nlp, text: str):
+def _iter_lines(path: str):
     """
-    Tokenize with spaCy as-is (no ASCII filtering, no lowercasing, no digit removal).
-    Skips whitespace tokens.
+    Yield the raw lines (bytes, without the newline) of a file through mmap: line ends
+    are found with mm.find in C and nothing is decoded here.
     """
-    if not isinstance(text, str):
-        text = str(text)
-    doc = nlp(text)
-    for tok in doc:
-        if tok.is_space:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            size = len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = size
+                yield mm[start:end]
+                start = end + 1
+
+def _read_corpus_file(path: str):
+    """Yield (ext_doc_id, text) for each parseable document with a doc_id in one NDJSON file."""
+    field_order = ["title", "doi", "date", "abstract"]  # same order as A1
+    for line in _iter_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            # Decoded as strict UTF-8 like Task 0's reader: json.loads would also accept
+            # bytes, but then it detects the encoding and skips a BOM that Task 0 rejects
+            obj = json.loads(line.decode("utf-8"))
+        except json.JSONDecodeError:
             continue
-        yield tok.text
+
+        ext_doc_id = obj.get("doc_id")
+        if not ext_doc_id:
+            continue
+
+        # Concatenate all relevant fields into one string
+        text_parts = [str(obj[field]) for field in field_order if obj.get(field)]
+        yield ext_doc_id, " ".join(text_parts)
+
+def _prefetched_docs(paths: list, maxsize: int = 4, batch: int = 1000):
+    """
+    Yield _read_corpus_file() items for all `paths` in order, reading and JSON-parsing
+    on a background thread. Items travel in lists of `batch` through a bounded queue,
+    so file I/O overlaps with tokenization while at most `maxsize` batches wait in memory.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        # Block on a full queue, but give up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            buf = []
+            for path in paths:
+                for item in _read_corpus_file(path):
+                    buf.append(item)
+                    if len(buf) >= batch:
+                        if not put(buf):
+                            return
+                        buf = []
+            if buf and not put(buf):
+                return
+            put(done)
+        except BaseException as e:  # handed to the consumer and re-raised there
+            put(e)
+
+    t = threading.Thread(target=produce, name="corpus-reader", daemon=True)
+    t.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+    finally:
+        stop.set()
+        t.join()
+
+def _iter_doc_texts(inv: InvertedIndex, paths: list, doc_limit: Optional[int]):
+    """
+    Yield (text, internal doc id) for every new document, assigning doc ids in corpus
+    order. Malformed lines, documents without doc_id and repeated doc_ids are skipped.
+    """
+    doc_count = 0
+
+    # Files are read and parsed ahead on a reader thread while spaCy works
+    for ext_doc_id, text in _prefetched_docs(paths):
+        if doc_limit is not None and doc_count >= doc_limit:
+            print(f"Reached doc limit {doc_limit}, stopping.")
+            return
+        if ext_doc_id in inv.doc2id:
+            continue  # doc2id already records every id seen; no separate set needed
+
+        did = inv.assign_doc_id(ext_doc_id)
+        doc_count += 1
+        yield text, did
+
+def _doc_positions(doc, token2id_get):
+    """
+    (document length, [(term_id, ascending positions), ...]) for one tokenized doc,
+    terms in order of first occurrence; whitespace tokens are skipped.
+    """
+    texts = [tok.text for tok in doc if not tok.is_space]
+    # token -> term id for the whole document in one C-level map()
+    tids = list(map(token2id_get, texts))
+    tid_at = tids.__getitem__
+    # One stable sort of the in-vocab positions by term id groups each term's
+    # positions into a single ascending run: no per-document dict of lists
+    order = [p for p, tid in enumerate(tids) if tid is not None]
+    order.sort(key=tid_at)
+    # array('i') like the index's own position store: unboxed ints, and add_posting
+    # extends from it with a plain memory copy
+    runs = [(tid, array("i", group)) for tid, group in groupby(order, key=tid_at)]
+    runs.sort(key=lambda run: run[1][0])  # back to first-occurrence order, as the index expects
+    return len(texts), runs
+
+
+# Per-process vocabulary of build workers, set once by _init_build_worker
+_W_TOKEN2ID = None
+
+def _init_build_worker(vocab_path: str):
+    """Pool initializer: load the tokenizer and vocabulary once per worker."""
+    global _W_TOKEN2ID
+    _init_tokenizer()
+    vocab = InvertedIndex()
+    vocab.load_vocab(vocab_path)
+    _W_TOKEN2ID = vocab.token2id
+
+def _index_file_worker(path: str) -> list:
+    """
+    Pool task: tokenize one corpus file (read by the worker itself, not sent over IPC).
+    Returns [(ext_doc_id, doc_len, [(term_id, positions), ...]), ...] in file order;
+    doc_ids repeated within the file are dropped here, across files by the parent.
+    """
+    seen_docs = set()
+
+    def texts():
+        for ext_doc_id, text in _read_corpus_file(path):
+            if ext_doc_id not in seen_docs:
+                seen_docs.add(ext_doc_id)
+                yield text, ext_doc_id
+
+    token2id_get = _W_TOKEN2ID.get
+    out = []
+    for doc, ext_doc_id in _init_tokenizer().pipe(texts(), as_tuples=True, batch_size=TOKENIZE_BATCH_SIZE):
+        out.append((ext_doc_id, *_doc_positions(doc, token2id_get)))
+    return out
+
+def _pool_context():
+    """
+    Prefer fork where the platform has it (Linux/macOS), so workers inherit the
+    parent's tokenizer copy-on-write; elsewhere _init_build_worker loads it.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def _build_parallel(inv: InvertedIndex, paths: list, vocab_path: str) -> None:
+    """Index `paths` with a pool of workers and merge their documents into `inv`."""
+    _init_tokenizer()  # built before forking, so _init_build_worker finds it loaded
+    with _pool_context().Pool(processes=min(BUILD_PROCESSES, len(paths)), initializer=_init_build_worker,
+              initargs=(vocab_path,)) as pool:
+        # imap (not imap_unordered) hands files back in corpus order, so doc ids, the
+        # first-wins dedupe across files and term insertion order match the serial build
+        for docs in pool.imap(_index_file_worker, paths):
+            for ext_doc_id, n, postings in docs:
+                if ext_doc_id in inv.doc2id:
+                    continue
+                did = inv.assign_doc_id(ext_doc_id)
+                inv.doc_len[ext_doc_id] = n
+                for tid, positions in postings:
+                    inv.add_posting(tid, did, positions)
 
 
 # --------------- REQUIRED FUNCTIONS ----------------
@@ -90,66 +337,50 @@ def build_index(corpus_dir: str, vocab_path: str, doc_limit: Optional[int] = Non
     inv = InvertedIndex()
     inv.load_vocab(vocab_path)
 
-    nlp = _init_tokenizer()
-    seen_docs = set()
-    field_order = ["title", "doi", "date", "abstract"]  # same order as A1
+    # The build creates millions of long-lived containers (postings arrays, dict entries,
+    # doc ids) and no reference cycles, so cyclic GC passes would only rescan them.
+    # Collection is paused for the build only.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _build(inv, vocab_path, corpus_dir, doc_limit)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return inv
 
-    print("DOC LIMIT IS:", doc_limit if doc_limit is not None else "NO LIMIT")
-    doc_count = 0
 
-    for fname in os.listdir(corpus_dir):
-        path = os.path.join(corpus_dir, fname)
-        if not os.path.isfile(path):
-            continue
+def _build(inv: InvertedIndex, vocab_path: str, corpus_dir: str, doc_limit: Optional[int]) -> None:
+    """Fill `inv` from the corpus, with a worker pool or in this process."""
+    print("DOC LIMIT IS:", doc_limit if doc_limit is not None else "NO LIMIT")
+    paths = _corpus_files(corpus_dir)
 
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                if doc_limit is not None and doc_count >= doc_limit:
-                    print(f"Reached doc limit {doc_limit}, stopping.")
-                    return inv  
+    # A doc limit needs one global running count, so it keeps the serial path
+    if doc_limit is None and BUILD_PROCESSES > 1 and len(paths) > 1:
+        _build_parallel(inv, paths, vocab_path)
+    else:
+        _build_serial(inv, paths, doc_limit)
 
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
 
-                ext_doc_id = obj.get("doc_id")
-                if not ext_doc_id:
-                    continue
-                if ext_doc_id in seen_docs:
-                    continue
-                seen_docs.add(ext_doc_id)
+def _build_serial(inv: InvertedIndex, paths: list, doc_limit: Optional[int]) -> None:
+    """Tokenize and index `paths` in this process (spaCy may still fan out via nlp.pipe)."""
+    nlp = _init_tokenizer()
+    # Tokenize in batches (spaCy raw); the doc id rides along with each text
+    docs = nlp.pipe(_iter_doc_texts(inv, paths, doc_limit), as_tuples=True,
+                    batch_size=TOKENIZE_BATCH_SIZE, n_process=TOKENIZE_PROCESSES)
+    # Hot loop: bind everything it touches to locals once
+    token2id_get = inv.token2id.get
+    id2doc = inv.id2doc
+    doc_len = inv.doc_len
+    add_posting = inv.add_posting
+    for doc, did in docs:
+        pos, runs = _doc_positions(doc, token2id_get)
 
-                did = inv.assign_doc_id(ext_doc_id)
-                doc_count += 1
-                # print(f"Processed doc {doc_count}: {ext_doc_id}")
-
-                per_doc_positions = defaultdict(list)
-                pos = 0
-
-                # Concatenate all relevant fields into one string and tokenize (spaCy raw)
-                text_parts = [str(obj[field]) for field in field_order if obj.get(field)]
-                text = " ".join(text_parts)
-                for token in _tokenize_spacy_raw(nlp, text):
-                    tid = inv.token2id.get(token)
-                    if tid is not None:
-                        per_doc_positions[tid].append(pos)
-                    pos += 1
-
-                # Record document length for BM25 normalization (post-tokenization count)
-                inv.doc_len[ext_doc_id] = pos
-
-                for tid, positions in per_doc_positions.items():
-                    positions_sorted = sorted(positions)
-                    inv.postings[tid][did] = {
-                        "tf": len(positions_sorted),
-                        "positions": positions_sorted
-                    }
+        # Record document length for BM25 normalization (post-tokenization count)
+        doc_len[id2doc[did]] = pos
 
-    return inv
+        for tid, positions in runs:
+            add_posting(tid, did, positions)  # already ascending
 
 
 def save_index(inv: InvertedIndex, index_dir: str) -> None:
@@ -157,6 +388,10 @@ def save_index(inv: InvertedIndex, index_dir: str) -> None:
     Save to index.json with deterministic ordering:
       - terms sorted by token alphabetically
       - docs sorted by external doc_id alphabetically
+    Also writes index_offsets.json ({term: [byte offset, byte length]} of each
+    term's value in index.json, under "terms") so readers can load single terms
+    without parsing the whole index. It records index.json's fingerprint (see
+    _file_fingerprint), which readers check before trusting the offsets.
     {
       "term": {
         "df": int,
@@ -169,28 +404,78 @@ def save_index(inv: InvertedIndex, index_dir: str) -> None:
     }
     """
     os.makedirs(index_dir, exist_ok=True)
-    result = {}
-
-    term_ids_sorted = sorted(inv.postings.keys(), key=lambda tid: inv.id2token[tid])
-
-    for tid in term_ids_sorted:
-        term = inv.id2token[tid]
-        postings = inv.postings[tid]
-
-        doc_ids_sorted = sorted(postings.keys(), key=lambda did: inv.id2doc[did])
-
-        term_obj = {}
-        for did in doc_ids_sorted:
-            ext_id = inv.id2doc[did]
-            entry = postings[did]
-            term_obj[ext_id] = {"tf": entry["tf"], "pos": entry["positions"]}
-            
-        result[term] = {"df": len(term_obj), "postings": term_obj}
 
+    id2token = inv.id2token
+    id2doc = inv.id2doc
+    # load_vocab sorts the vocabulary, so ascending term id is ascending token
+    term_ids_sorted = [tid for tid in range(len(id2token)) if tid in inv.doc_ids]
+    # Rank of every internal doc id in external-id order: one string sort for the whole
+    # collection, after which each term's postings are ordered by comparing small ints
+    doc_rank = [0] * len(id2doc)
+    for rank, did in enumerate(sorted(range(len(id2doc)), key=id2doc.__getitem__)):
+        doc_rank[did] = rank
+
+    # JSON-encoded doc id keys, built once and shared by every term. Object keys must
+    # be strings, so non-string ids are converted as json.dumps would for a dict key
+    doc_keys = [json.dumps(str(d)) for d in id2doc]
+
+    # Stream one term at a time, writing the JSON text straight from the SoA arrays
+    # (no per-posting dicts). The fragments spell out exactly what
+    # json.dumps(..., separators=(",", ":")) would emit for the whole index.
+    # The output is pure ASCII (json.dumps escapes everything else), so string
+    # lengths are byte lengths and each term's value can be located for the
+    # index_offsets.json sidecar: term -> [byte offset, byte length] of its value.
+    offsets = {}
+    written = 0
     out_path = os.path.join(index_dir, "index.json")
     with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, separators=(",", ":"))  # compact
-        # json.dump(result, f, indent=2)  # pretty
+        f.write("{")
+        written += 1
+        for i, tid in enumerate(term_ids_sorted):
+            doc_ids = inv.doc_ids[tid]
+            tfs = inv.tfs[tid]
+            positions = inv.positions[tid]
+            offs = inv.pos_offsets[tid]
+            ranks = list(map(doc_rank.__getitem__, doc_ids))
+
+            head = (',' if i else '') + json.dumps(id2token[tid]) + ':'
+            parts = ['{"df":', str(len(doc_ids)), ',"postings":{']
+            for j, k in enumerate(sorted(range(len(doc_ids)), key=ranks.__getitem__)):
+                parts.append(',' if j else '')
+                parts.append(doc_keys[doc_ids[k]])
+                parts.append(':{"tf":')
+                parts.append(str(tfs[k]))
+                parts.append(',"pos":[')
+                parts.append(",".join(map(str, positions[offs[k]:offs[k + 1]])))
+                parts.append(']}')
+            parts.append('}}')
+            value = "".join(parts)
+            f.write(head)
+            f.write(value)
+            offsets[id2token[tid]] = [written + len(head), len(value)]
+            written += len(head) + len(value)
+        f.write("}")
+
+    sidecar = {"index.json": _file_fingerprint(out_path), "terms": offsets}
+    with open(os.path.join(index_dir, "index_offsets.json"), "w", encoding="utf-8") as f:
+        f.write(json.dumps(sidecar, separators=(",", ":")))
+
+
+def _file_fingerprint(path: str, chunk: int = 1 << 16) -> list:
+    """
+    [size, digest of the first and last `chunk` bytes] of a file. Sidecars record the
+    fingerprint of the JSON file they were derived from, so a reader can tell when
+    that file has been rebuilt or replaced without them; reading only the ends keeps
+    the check cheap on a multi-GB index.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read())
+    return [size, h.hexdigest()]
 
 
 def load_index(index_dir: str) -> dict:
@@ -227,7 +512,61 @@ def save_bm25_stats(inv: InvertedIndex, index_dir: str) -> None:
     }
     out_path = os.path.join(index_dir, "bm25.json")
     with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, separators=(",", ":"))
+        f.write(json.dumps(payload, separators=(",", ":")))
+    save_bm25_arrays(inv, index_dir)
+
+
+def save_bm25_arrays(inv: InvertedIndex, index_dir: str) -> None:
+    """
+    Binary sidecar bm25.bin of the postings BM25 needs (doc and tf, no positions),
+    laid out as written by _write_sidecar:
+      - meta: doc_names (doc number -> doc id, in bm25.json's doc_len order),
+        term -> [byte offset, posting count, df] into the arrays, and N, the doc
+        count and the fingerprints of bm25.json and index.json, which readers check
+        against the JSON before using the sidecar
+      - arrays: per term, its doc numbers as int32 followed by its tfs as int32
+    Arrays are in native byte order, recorded as "byteorder".
+    """
+    doc_names = list(inv.doc_len)
+    doc_num = {doc: i for i, doc in enumerate(doc_names)}
+    # Internal doc id -> doc number
+    num_of = array("i", (doc_num[ext] for ext in inv.id2doc))
+    term_ids = inv.term_ids()
+    itemsize = array("i").itemsize
+    # Offsets only depend on posting counts, so the meta is complete before any array is written
+    terms = {}
+    offset = 0
+    for tid in term_ids:
+        n = len(inv.doc_ids[tid])
+        terms[inv.id2token[tid]] = [offset, n, inv.df(tid)]
+        offset += 2 * n * itemsize
+    index_path = os.path.join(index_dir, "index.json")
+    meta = {
+        "byteorder": sys.byteorder,
+        "N": len(inv.id2doc),
+        "n_docs": len(doc_names),
+        "bm25.json": _file_fingerprint(os.path.join(index_dir, "bm25.json")),
+        "index.json": _file_fingerprint(index_path) if os.path.exists(index_path) else None,
+        "doc_names": doc_names,
+        "terms": terms,
+    }
+    with open(os.path.join(index_dir, "bm25.bin"), "wb") as f:
+        _write_sidecar(f, BM25_MAGIC, meta)
+        for tid in term_ids:
+            array("i", map(num_of.__getitem__, inv.doc_ids[tid])).tofile(f)
+            inv.tfs[tid].tofile(f)
+
+
+def _write_sidecar(f, magic: bytes, meta: dict) -> None:
+    """
+    Header of a binary sidecar: the 8-byte `magic`, the byte length of the meta as an
+    8-byte little-endian int, then the meta as UTF-8 JSON. The arrays follow, and
+    offsets in the meta count from the end of the header.
+    """
+    data = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    f.write(magic)
+    f.write(len(data).to_bytes(8, "little"))
+    f.write(data)
 
 
 def save_vsm_index(inv: InvertedIndex, index_dir: str):
@@ -235,23 +574,22 @@ def save_vsm_index(inv: InvertedIndex, index_dir: str):
     N = len(inv.id2doc)
     idf = {}  # calculated for each term
     doc_norms = defaultdict(float)
-    postings_out = defaultdict(dict)  # containing the list of documents and the tf for each term
+    postings_out = defaultdict(dict)  # containing the list of documents and the weight w_td for each term
 
     # loop through each term
-    for tid, postings in inv.postings.items():
+    for tid in inv.term_ids():
         term = inv.id2token[tid]
-        df = len(postings)
+        df = inv.df(tid)
         idf[term] = math.log(N / df)
 
-        for did, info in postings.items():
+        for did, tf in zip(inv.doc_ids[tid], inv.tfs[tid]):
             ext_doc_id = inv.id2doc[did]
-            tf = info["tf"]
 
-            # store for postings
-            postings_out[term][ext_doc_id] = tf
+            # tf and idf are static, so store the document weight itself
+            w_td = (1 + math.log(tf)) * idf[term]
+            postings_out[term][ext_doc_id] = w_td
 
             # accumulate squared weights for doc norms
-            w_td = (1 + math.log(tf)) * idf[term]
             doc_norms[ext_doc_id] += w_td ** 2
 
     for doc in doc_norms:
@@ -261,12 +599,50 @@ def save_vsm_index(inv: InvertedIndex, index_dir: str):
         "N": N,
         "idf": idf,
         "doc_norms": dict(doc_norms),
-        "postings": postings_out
+        "postings": postings_out,
+        "weighted": True  # postings hold w_td = (1 + log tf) * idf, not raw tf
     }
 
     os.makedirs(index_dir, exist_ok=True)
     with open(os.path.join(index_dir, "vsm.json"), "w", encoding="utf-8") as f:
-        json.dump(vsm_data, f, separators=(",", ":"))
+        f.write(json.dumps(vsm_data, separators=(",", ":")))
+    save_vsm_arrays(vsm_data, index_dir)
+
+
+def save_vsm_arrays(vsm_data: dict, index_dir: str):
+    """
+    Binary sidecar vsm.bin of vsm.json for fast query-time loading, laid out as
+    written by _write_sidecar:
+      - meta: idf, doc_names (doc number -> doc id), term -> [byte offset, posting
+        count] into the arrays, and N and the fingerprint of vsm.json, which
+        readers check before using the sidecar
+      - arrays: per term (vocabulary order), its doc numbers as int32 followed by
+        its cosine-normalized weights w_td / |d| as float64, in the same order as
+        vsm.json
+    Arrays are in native byte order, recorded as "byteorder".
+    """
+    norms = vsm_data["doc_norms"]
+    doc_names = list(norms)
+    doc_num = {doc: i for i, doc in enumerate(doc_names)}
+    step = array("i").itemsize + array("d").itemsize
+    terms = {}
+    offset = 0
+    for term, plist in vsm_data["postings"].items():
+        terms[term] = [offset, len(plist)]
+        offset += step * len(plist)
+    meta = {
+        "byteorder": sys.byteorder,
+        "N": vsm_data["N"],
+        "vsm.json": _file_fingerprint(os.path.join(index_dir, "vsm.json")),
+        "idf": vsm_data["idf"],
+        "doc_names": doc_names,
+        "terms": terms,
+    }
+    with open(os.path.join(index_dir, "vsm.bin"), "wb") as f:
+        _write_sidecar(f, VSM_MAGIC, meta)
+        for plist in vsm_data["postings"].values():
+            array("i", map(doc_num.__getitem__, plist)).tofile(f)
+            array("d", (w / norms[doc] if norms[doc] > 0 else w for doc, w in plist.items())).tofile(f)
 
 
 if __name__ == "__main__":
@@ -278,6 +654,9 @@ if __name__ == "__main__":
     corpus_dir, vocab_file, index_dir = sys.argv[1:4]
 
     inv = build_index(corpus_dir, vocab_file)
+    # The script exits after saving, so the index can move to the permanent generation
+    # and the collections triggered while saving skip it
+    gc.freeze()
     save_index(inv, index_dir)
     save_bm25_stats(inv, index_dir)
     save_vsm_index(inv, index_dir)
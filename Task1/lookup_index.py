@@ -3,19 +3,100 @@
 lookup_index.py: Utility to inspect terms and postings in a large index.json file.
 
 Usage:
-    python3 lookup_index.py <index.json> [--term <term>] [--n N]
+    python3 lookup_index.py <index.json> [--term <term>] [--n N] [--no-count]
 
 - If --term is provided, prints the entry for that term (if present).
 - Otherwise, prints the structure for the first N terms (default: 5).
+- The sample listing also reports the total number of terms, which reads the whole
+  file; --no-count skips it so only the first N terms are read.
 - If the index file does not exist, can optionally call build_index.py to create it (not implemented here for safety).
+
+The index is streamed one term at a time instead of loaded whole; --term and
+--no-count stop reading as soon as they have their answer.
 """
 import sys
 import json
 from itertools import islice
 
+_WS = " \t\n\r"
+
+
+def iter_index_items(path, chunk_size=1 << 20):
+    """
+    Yield (term, entry) pairs from index.json in file order, decoding one term's
+    entry at a time with JSONDecoder.raw_decode over a sliding text buffer.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def more(grow=False):
+            # grow=True reads at least as much as is buffered, so one huge entry
+            # costs O(size) re-decodes overall rather than O(size / chunk_size)
+            nonlocal buf, pos, eof
+            size = max(chunk_size, len(buf) - pos) if grow else chunk_size
+            data = f.read(size)
+            eof = not data
+            buf = buf[pos:] + data
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                more()
+
+        def decode():
+            # Entries are strings/objects, so a value cut off by the buffer end
+            # fails to decode instead of parsing short; read more and retry
+            nonlocal pos
+            while True:
+                try:
+                    value, pos = decoder.raw_decode(buf, pos)
+                    return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    more(grow=True)
+
+        def expect(ch):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] != ch:
+                raise ValueError(f"Malformed index: expected {ch!r} in {path}")
+            pos += 1
+
+        expect("{")
+        first = True
+        while True:
+            skip_ws()
+            if pos < len(buf) and buf[pos] == "}":
+                return
+            if not first:
+                expect(",")
+                skip_ws()
+            first = False
+            term = decode()
+            expect(":")
+            skip_ws()
+            yield term, decode()
+
+
+def _print_postings(entry, limit=None):
+    print(f"  df = {entry['df']}")
+    print(f"  postings:")
+    for docid, docinfo in islice(entry['postings'].items(), limit):
+        print(f"    doc_id: {docid}, tf: {docinfo['tf']}, positions: {docinfo['pos']}")
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <index.json> [--term <term>] [--n N]")
+        print(f"Usage: {sys.argv[0]} <index.json> [--term <term>] [--n N] [--no-count]")
         sys.exit(1)
 
     path = sys.argv[1]
@@ -34,27 +115,25 @@ if __name__ == "__main__":
             except Exception:
                 pass
 
-    with open(path, "r", encoding="utf-8") as f:
-        idx_data = json.load(f)
-
     if term:
-        if term in idx_data:
-            entry = idx_data[term]
-            print(f"TERM: {term}")
-            print(f"  df = {entry['df']}")
-            print(f"  postings:")
-            for docid, docinfo in entry['postings'].items():
-                print(f"    doc_id: {docid}, tf: {docinfo['tf']}, positions: {docinfo['positions']}")
+        # save_index writes terms in sorted order, so the scan can stop once past `term`
+        for t, entry in iter_index_items(path):
+            if t == term:
+                print(f"TERM: {term}")
+                _print_postings(entry)
+                break
+            if t > term:
+                print(f"Term '{term}' not found in index.")
+                break
         else:
             print(f"Term '{term}' not found in index.")
     else:
-        print(f"Total terms: {len(idx_data)}")
+        items = iter_index_items(path)
+        sample = list(islice(items, n))
+        if '--no-count' not in args:
+            # Same pass: keep counting past the sampled terms
+            print(f"Total terms: {len(sample) + sum(1 for _ in items)}")
         print("--- sample terms ---")
-        for t, entry in islice(idx_data.items(), n):
+        for t, entry in sample:
             print(f"\nTERM: {t}")
-            print(f"  df = {entry['df']}")
-            print(f"  postings:")
-            for i, (docid, docinfo) in enumerate(entry['postings'].items()):
-                if i >= 3:
-                    break
-                print(f"    doc_id: {docid}, tf: {docinfo['tf']}, positions: {docinfo['positions']}")
+            _print_postings(entry, 3)
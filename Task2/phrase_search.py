@@ -18,6 +18,11 @@ Behavior:
 import os
 import sys
 import json
+import codecs
+import hashlib
+from bisect import bisect_left
+from itertools import chain
+import multiprocessing
 from typing import Dict, List, Iterable, Tuple, Optional
 
 try:
@@ -27,22 +32,138 @@ except ImportError as e:
         "spaCy is required. Install with: pip install spacy"
     ) from e
 
+# Phrases of 3+ terms whose rarest term is in at most this many docs are verified
+# straight from that term's docs instead of through bigram doc sets
+DIRECT_VERIFY_MAX_DOCS = 64
+# phrase_match_in_doc switches from bisect probing to shifted-set intersection
+# once the shortest position list has at least this many entries
+SHIFTED_SET_MIN_POSITIONS = 8
+# Worker processes for matching queries (1 = single process, the default;
+# query runs are short and dominated by loading the index)
+QUERY_PROCESSES = int(os.environ.get("QUERY_PROCESSES", "1"))
 
-def load_index(index_dir: str) -> Dict[str, dict]:
+
+def load_index(index_dir: str, terms: Optional[Iterable[str]] = None) -> Dict[str, dict]:
+    """
+    Load index.json. With `terms`, only those terms' entries are loaded: each one is
+    read by seeking to its byte range from index_offsets.json (written next to the
+    index by Task 1), so the rest of the index is never parsed. The sidecar is only
+    used when the index.json fingerprint it records still matches; otherwise (or
+    without it) the whole index is parsed and filtered.
+    """
     path = os.path.join(index_dir, "index.json")
+    if terms is not None:
+        offsets = _load_offsets(index_dir, path)
+        if offsets is not None:
+            index = {}
+            with open(path, "rb") as f:
+                for term in terms:
+                    span = offsets.get(term)
+                    if span is None:
+                        continue
+                    f.seek(span[0])
+                    index[sys.intern(term)] = json.loads(f.read(span[1]))
+            return index
     with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        index = json.load(f)
+    if terms is not None:
+        index = {sys.intern(t): index[t] for t in terms if t in index}
+    return index
+
+
+def _load_offsets(index_dir: str, index_path: str) -> Optional[Dict[str, list]]:
+    """term -> [byte offset, byte length] from index_offsets.json, or None when the
+    sidecar is missing, unreadable or was written for a different index.json."""
+    offsets_path = os.path.join(index_dir, "index_offsets.json")
+    if not os.path.exists(offsets_path):
+        return None
+    try:
+        with open(offsets_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+    except ValueError:
+        return None
+    if not isinstance(sidecar, dict) or "terms" not in sidecar:
+        return None
+    if sidecar.get("index.json") != _file_fingerprint(index_path):
+        return None
+    return sidecar["terms"]
+
+
+def _file_fingerprint(path: str, chunk: int = 1 << 16) -> list:
+    """[size, digest of the first and last `chunk` bytes] of a file, as recorded by
+    Task 1 (build_index._file_fingerprint) for the file a sidecar was derived from."""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read())
+    return [size, h.hexdigest()]
+
+
+# Built on first use and shared by every query (see init_tokenizer)
+_NLP = None
 
 
 def init_tokenizer():
-    nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
-    nlp.max_length = 300_000_000
-    return nlp
+    global _NLP
+    if _NLP is None:
+        nlp = spacy.blank("en")  # rule-based English tokenizer; no internet needed
+        nlp.max_length = 300_000_000
+        _NLP = nlp
+    return _NLP
+
+
+def _fast_tokens(nlp, text: str) -> Optional[List[str]]:
+    """
+    Tokens of `text` without running spaCy, or None when spaCy is needed.
+    Only ASCII letters separated by plain spaces qualify: such words have no
+    prefix/suffix/infix splits, so spaCy keeps each one whole unless it is a
+    tokenizer exception ("cannot", "Dont", ...), which sends it to spaCy.
+    """
+    if not (text.isascii() and text.replace(" ", "").isalpha()):
+        return None
+    words = text.split()
+    rules = nlp.tokenizer.rules
+    for w in words:
+        if w in rules:
+            return None
+    return words
 
 
 def tokenize_query(nlp, text: str) -> List[str]:
-    doc = nlp(text if isinstance(text, str) else str(text))
-    return [t.text for t in doc if not t.is_space]
+    """
+    Query tokens, interned: load_index interns the index keys too, so the many
+    postings lookups per query compare by identity instead of by characters.
+    """
+    # Through the batch path, so a lone query gets the same fast-path check
+    return tokenize_queries(nlp, [text])[0]
+
+
+QUERY_BATCH_SIZE = 64
+# Fast-path tokenizations checked against spaCy per tokenize_queries call
+FAST_PATH_CHECK_SAMPLE = 16
+
+
+def tokenize_queries(nlp, texts: List[str]) -> List[List[str]]:
+    """tokenize_query for many texts: the ones that miss the fast path go through
+    a single nlp.pipe call instead of one tokenizer call each."""
+    texts = [t if isinstance(t, str) else str(t) for t in texts]
+    out = [_fast_tokens(nlp, t) for t in texts]
+    fast = [i for i, toks in enumerate(out) if toks is not None]
+    if fast:
+        # Spot-check the fast path against spaCy on an evenly spread sample of this
+        # batch; any disagreement (e.g. a different tokenizer) sends it all to spaCy
+        sample = fast[::max(1, len(fast) // FAST_PATH_CHECK_SAMPLE)][:FAST_PATH_CHECK_SAMPLE]
+        for i, doc in zip(sample, nlp.pipe(texts[i] for i in sample)):
+            if out[i] != [t.text for t in doc if not t.is_space]:
+                out = [None] * len(texts)
+                break
+    slow = [i for i, toks in enumerate(out) if toks is None]
+    for i, doc in zip(slow, nlp.pipe((texts[i] for i in slow), batch_size=QUERY_BATCH_SIZE)):
+        out[i] = [t.text for t in doc if not t.is_space]
+    return [[sys.intern(t) for t in toks] for toks in out]
 
 
 def phrase_match_in_doc(positions_lists: List[List[int]]) -> bool:
@@ -56,47 +177,139 @@ def phrase_match_in_doc(positions_lists: List[List[int]]) -> bool:
     if len(positions_lists) == 1:
         return len(positions_lists[0]) > 0
 
-    # For efficient membership checks, convert subsequent lists to sets.
-    sets = [set(lst) for lst in positions_lists]
-    first = positions_lists[0]
-    for p in first:
-        ok = True
-        for i in range(1, len(positions_lists)):
-            if (p + i) not in sets[i]:
-                ok = False
+    # When every list is long, intersect the sets of implied phrase starts (p - i)
+    # instead; set intersection runs in C and beats one bisect per anchor position
+    by_len = sorted(range(len(positions_lists)), key=lambda i: len(positions_lists[i]))
+    if len(positions_lists[by_len[0]]) >= SHIFTED_SET_MIN_POSITIONS:
+        starts = {p - by_len[0] for p in positions_lists[by_len[0]]}
+        for i in by_len[1:]:
+            starts.intersection_update([p - i for p in positions_lists[i]])
+            if not starts:
+                return False
+        return True
+
+    # Anchor on the shortest list: each of its positions fixes the phrase start, and
+    # the other lists are probed with bisect. Anchor positions ascend, so every
+    # probe can start where the previous one in the same list ended.
+    anchor = by_len[0]
+    others = [(i - anchor, lst) for i, lst in enumerate(positions_lists) if i != anchor]
+    lo = [0] * len(others)
+    for p in positions_lists[anchor]:
+        if p < anchor:
+            continue  # the phrase would start before position 0
+        for j, (shift, lst) in enumerate(others):
+            target = p + shift
+            idx = bisect_left(lst, target, lo[j])
+            if idx == len(lst):
+                return False  # later anchors need even larger targets
+            lo[j] = idx
+            if lst[idx] != target:
                 break
-        if ok:
+        else:
             return True
     return False
 
 
-def _phrase_search_candidates(index: Dict[str, dict], query_tokens: List[str]) -> List[str]:
+def _positions(entry) -> list:
+    positions = entry.get("pos") if isinstance(entry, dict) else None
+    if positions is None:
+        positions = entry.get("positions", [])
+    return positions
+
+
+def _bigram_docs(index: Dict[str, dict], first: str, second: str,
+                 bigram_cache: Dict[Tuple[str, str], frozenset]) -> frozenset:
+    """Doc ids in which `second` occurs directly after `first`, memoized per pair."""
+    key = (first, second)
+    docs = bigram_cache.get(key)
+    if docs is None:
+        p1 = index[first]["postings"]
+        p2 = index[second]["postings"]
+        small, large = (p1, p2) if len(p1) <= len(p2) else (p2, p1)
+        docs = frozenset(
+            d for d in small
+            if d in large and phrase_match_in_doc([_positions(p1[d]), _positions(p2[d])])
+        )
+        bigram_cache[key] = docs
+    return docs
+
+
+def _phrase_search_candidates(index: Dict[str, dict], query_tokens: List[str],
+                              bigram_cache: Optional[Dict[Tuple[str, str], frozenset]] = None) -> List[str]:
     if not query_tokens:
         return []
     for tok in query_tokens:
         if tok not in index:
             return []
-    posting_keys = [set(index[tok]["postings"].keys()) for tok in query_tokens]
-    if not posting_keys:
-        return []
-    candidate_docs = set.intersection(*posting_keys)
-    if not candidate_docs:
+    postings_per_token = [index[tok]["postings"] for tok in query_tokens]
+    rarest = min(postings_per_token, key=len)
+    if not rarest:
         return []
-    matches = []
-    for doc_id in candidate_docs:
-        positions_lists = []
-        for tok in query_tokens:
-            entry = index[tok]["postings"][doc_id]
-            positions = entry.get("pos") if isinstance(entry, dict) else None
-            if positions is None:
-                positions = entry.get("positions", [])
-            positions_lists.append(list(positions))
-        if phrase_match_in_doc(positions_lists):
-            matches.append(doc_id)
+    if len(query_tokens) > 2 and len(rarest) <= DIRECT_VERIFY_MAX_DOCS:
+        # A rare term bounds the answer by itself: check its few docs directly rather
+        # than building bigram sets for pairs of frequent terms
+        candidate_docs = [d for d in rarest if all(d in p for p in postings_per_token)]
+    elif len(query_tokens) > 1:
+        # Every adjacent pair of the phrase must be adjacent in the doc, so intersect
+        # the (cached) bigram hits first; postings never change for a loaded index
+        if bigram_cache is None:
+            bigram_cache = {}
+        pair_docs = sorted(
+            (_bigram_docs(index, a, b, bigram_cache) for a, b in zip(query_tokens, query_tokens[1:])),
+            key=len,
+        )
+        candidate_docs = set(pair_docs[0])
+        for docs in pair_docs[1:]:
+            candidate_docs &= docs
+            if not candidate_docs:
+                return []
+        if len(query_tokens) == 2:
+            return sorted(candidate_docs)
+    else:
+        candidate_docs = rarest
+    # Pairwise hits can come from different places in the doc; verify the whole chain
+    # (position lists are passed as stored, they are only read)
+    matches = [
+        doc_id for doc_id in candidate_docs
+        if phrase_match_in_doc([_positions(p[doc_id]) for p in postings_per_token])
+    ]
     matches.sort()
     return matches
 
 
+# Per-worker state for _match_parallel, set by the pool initializer
+_W_INDEX = None
+_W_BIGRAMS = None
+
+
+def _init_match_worker(index: Dict[str, dict]) -> None:
+    """Pool initializer: keep the index (inherited, not copied, when forked)."""
+    global _W_INDEX, _W_BIGRAMS
+    _W_INDEX = index
+    _W_BIGRAMS = {}
+
+
+def _match_worker(key: Tuple[str, ...]) -> Tuple[Tuple[str, ...], List[str]]:
+    return key, _phrase_search_candidates(_W_INDEX, list(key), _W_BIGRAMS)
+
+
+def _pool_context():
+    """
+    Prefer fork where the platform has it (Linux/macOS), so workers inherit the
+    loaded index copy-on-write; elsewhere it is pickled to each worker.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _match_parallel(index: Dict[str, dict], keys: List[Tuple[str, ...]]) -> List[Tuple[Tuple[str, ...], List[str]]]:
+    """Match each distinct token tuple in `keys` using a pool of worker processes."""
+    processes = min(QUERY_PROCESSES, len(keys))
+    with _pool_context().Pool(processes=processes, initializer=_init_match_worker, initargs=(index,)) as pool:
+        return pool.map(_match_worker, keys, chunksize=max(1, len(keys) // (processes * 4)))
+
+
 # Public API per Assignment.md
 def phrase_search_query(query: str, index: dict) -> list:
     """Given the query string, return all matching document IDs (exact phrase)."""
@@ -111,80 +324,93 @@ def phrase_search(queryFile: str, index_dir: str, stopword_file: str, outFile: s
     TREC format: one line per hit -> "qid docid rank score"
     For boolean retrieval, score is a constant (1). Rank is 1..N in lexicographic docid order.
     """
-    index = load_index(index_dir)
     nlp = init_tokenizer()
-    queries = list(_read_queries_json(queryFile))
-    with open(outFile, "w", encoding="utf-8") as out:
-        for qid, text in queries:
-            toks = tokenize_query(nlp, text)
-            matches = _phrase_search_candidates(index, toks)
-            rank = 1
-            for doc_id in matches:
-                out.write(f"{qid} {doc_id} {rank} 1\n")
-                rank += 1
+    qids, texts = [], []
+    for qid, text in _read_queries_json(queryFile):
+        qids.append(qid)
+        texts.append(text)
+    queries = list(zip(qids, tokenize_queries(nlp, texts)))
+    # Only the postings of terms that some query uses are loaded
+    index = load_index(index_dir, {t for _, toks in queries for t in toks})
+    # Queries that tokenize identically share one answer
+    answer_cache: Dict[Tuple[str, ...], List[str]] = dict.fromkeys(tuple(toks) for _, toks in queries)
+    if QUERY_PROCESSES > 1 and len(answer_cache) > 1:
+        answer_cache.update(_match_parallel(index, list(answer_cache)))
+    else:
+        bigram_cache: Dict[Tuple[str, str], frozenset] = {}
+        for key in answer_cache:
+            answer_cache[key] = _phrase_search_candidates(index, list(key), bigram_cache)
+    with open(outFile, "w", encoding="utf-8", buffering=1 << 20) as out:
+        for qid, toks in queries:
+            matches = answer_cache[tuple(toks)]
+            # One write per query; ranks follow the lexicographic docid order
+            if matches:
+                out.write("".join(f"{qid} {doc_id} {rank} 1\n" for rank, doc_id in enumerate(matches, 1)))
+
+
+def _open_text(path: str):
+    """Open a text file for reading: UTF-16 when it starts with a UTF-16 BOM, else UTF-8."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+    if head in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return open(path, "r", encoding="utf-16")
+    return open(path, "r", encoding="utf-8-sig")
+
+
+def _query_from_obj(obj) -> Optional[Tuple[str, str]]:
+    """(qid, text) for one query object, or None if it has no query text."""
+    if not isinstance(obj, dict):
+        return None
+    qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
+    q = obj.get("query") or obj.get("text") or obj.get("title") or ""
+    if not q:
+        return None
+    return (str(qid) if qid != "" else q[:30], q)
 
 
 def _read_queries_json(path: str) -> Iterable[Tuple[str, str]]:
     """Attempt to read a JSON or JSONL file of queries.
     Accepts lines with objects having keys like: (query_id|qid|id) and (query|text|title).
-    Yields (qid, text).
+    Yields (qid, text). The encoding is picked once from the BOM and JSON-lines
+    files are parsed lazily, one line at a time.
     """
-    # Try JSON-lines first
-    try:
-        with open(path, "r", encoding="utf-16") as f:
-            content = f.read().strip()
-    except UnicodeDecodeError:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-    if not content:
-        return []
+    with _open_text(path) as f:
+        lines = (line.strip() for line in f)
+        first = next((line for line in lines if line), None)
+        if first is None:
+            return
+        second = next((line for line in lines if line), None)
 
-    # Try JSON-lines
-    lines = content.splitlines()
-    if len(lines) > 1:
-        out = []
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            q = obj.get("query") or obj.get("text") or obj.get("title") or ""
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
-        return out
+        # Try JSON-lines (more than one non-blank line)
+        if second is not None:
+            for line in chain((first, second), lines):
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                query = _query_from_obj(obj)
+                if query:
+                    yield query
+            return
 
     # Else try parsing as a single JSON object/array
     try:
-        data = json.loads(content)
+        data = json.loads(first)
     except json.JSONDecodeError:
-        return []
-    out = []
+        return
+    if isinstance(data, dict) and isinstance(data.get("queries"), list):
+        data = data["queries"]
     if isinstance(data, list):
         for obj in data:
-            if not isinstance(obj, dict):
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            q = obj.get("query") or obj.get("text") or obj.get("title") or ""
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
+            query = _query_from_obj(obj)
+            if query:
+                yield query
     elif isinstance(data, dict):
-        # either mapping id->text or an object with 'queries'
-        if "queries" in data and isinstance(data["queries"], list):
-            for obj in data["queries"]:
-                if not isinstance(obj, dict):
-                    continue
-                qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-                q = obj.get("query") or obj.get("text") or obj.get("title") or ""
-                if q:
-                    out.append((str(qid) if qid != "" else q[:30], q))
-        else:
-            for k, v in data.items():
-                out.append((str(k), str(v)))
-    return out
+        # mapping id->text
+        for k, v in data.items():
+            yield (str(k), str(v))
 
 
 def main(argv: List[str]) -> int:
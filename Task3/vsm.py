@@ -3,27 +3,209 @@ import os
 import sys
 import json
 import math
+import hashlib
+import codecs
+import heapq
+import mmap
+from array import array
 from collections import defaultdict
-from typing import List, Optional
+from itertools import chain, islice
+import multiprocessing
+from operator import itemgetter
+from typing import List, Optional, Tuple
 import spacy
 
+QUERY_BATCH_SIZE = 256
+# Fast-path tokenizations checked against spaCy per _tokenize_queries call
+FAST_PATH_CHECK_SAMPLE = 16
+# Worker processes for ranking queries (1 = single process, the default;
+# query runs are short and dominated by loading the index)
+QUERY_PROCESSES = int(os.environ.get("QUERY_PROCESSES", "1"))
+# First bytes of Task 1's vsm.bin sidecar (see build_index._write_sidecar)
+VSM_MAGIC = b"A2VSM\x00\x00\x01"
+
+# Built on first use and shared by every query (see _init_tokenizer)
+_NLP = None
+
 def _init_tokenizer():
-    nlp = spacy.blank("en")
-    nlp.max_length = 300_000_000
-    return nlp
+    global _NLP
+    if _NLP is None:
+        nlp = spacy.blank("en")
+        nlp.max_length = 300_000_000
+        _NLP = nlp
+    return _NLP
+
+def _fast_tokens(nlp, text: str):
+    """
+    Tokens of `text` without running spaCy, or None when spaCy is needed.
+    Only ASCII letters separated by plain spaces qualify; spaCy keeps such
+    words whole unless they are tokenizer exceptions, which fall back to spaCy.
+    """
+    if not (text.isascii() and text.replace(" ", "").isalpha()):
+        return None
+    words = text.split()
+    rules = nlp.tokenizer.rules
+    for w in words:
+        if w in rules:
+            return None
+    return words
+
+def _tokenize_queries(nlp, texts: List[str]) -> List[List[str]]:
+    """
+    Tokens of each text, as spaCy gives them minus whitespace tokens (no ASCII
+    filtering, no lowercasing, no digit removal). Texts that miss the fast path go
+    through a single nlp.pipe call.
+    """
+    texts = [t if isinstance(t, str) else str(t) for t in texts]
+    out = [_fast_tokens(nlp, t) for t in texts]
+    fast = [i for i, toks in enumerate(out) if toks is not None]
+    if fast:
+        # Spot-check the fast path against spaCy on an evenly spread sample of this
+        # batch; any disagreement (e.g. a different tokenizer) sends it all to spaCy
+        sample = fast[::max(1, len(fast) // FAST_PATH_CHECK_SAMPLE)][:FAST_PATH_CHECK_SAMPLE]
+        for i, doc in zip(sample, nlp.pipe(texts[i] for i in sample)):
+            if out[i] != [t.text for t in doc if not t.is_space]:
+                out = [None] * len(texts)
+                break
+    slow = [i for i, toks in enumerate(out) if toks is None]
+    for i, doc in zip(slow, nlp.pipe((texts[i] for i in slow), batch_size=QUERY_BATCH_SIZE)):
+        out[i] = [t.text for t in doc if not t.is_space]
+    return out
 
 def _tokenize_spacy_raw(nlp, text: str):
     """
     Tokenize with spaCy as-is (no ASCII filtering, no lowercasing, no digit removal).
-    Skips whitespace tokens.
+    Skips whitespace tokens. Goes through the batch path, so a lone query gets the
+    same fast-path check.
     """
-    if not isinstance(text, str):
-        text = str(text)
-    doc = nlp(text)
-    for tok in doc:
-        if tok.is_space:
-            continue
-        yield tok.text
+    yield from _tokenize_queries(nlp, [text])[0]
+
+# ---------------- INDEX PACKING ----------------
+
+def _packed_index(vsm_index: dict) -> dict:
+    """
+    Array form of vsm_index, built once and kept under vsm_index["_packed"]:
+    docs are numbered 0..N-1 and each term's postings become parallel arrays of
+    doc numbers and cosine-normalized document weights w_td / |d|, where
+    w_td = (1 + log tf) * idf. Indexes written with "weighted" already store w_td;
+    older ones store tf and are weighted here.
+    """
+    packed = vsm_index.get("_packed")
+    if packed is not None:
+        return packed
+    weighted = vsm_index.get("weighted", False)
+    idf = vsm_index["idf"]
+    doc_norms = vsm_index["doc_norms"]
+    doc_names = list(doc_norms)
+    doc_num = {doc: i for i, doc in enumerate(doc_names)}
+    postings = {}
+    for term, plist in vsm_index["postings"].items():
+        nums = array("i")
+        weights = array("d")
+        idf_t = idf[term]
+        for doc, value in plist.items():
+            i = doc_num.get(doc)
+            if i is None:
+                i = doc_num[doc] = len(doc_names)
+                doc_names.append(doc)
+            nums.append(i)
+            w_td = value if weighted else (1 + math.log(value)) * idf_t
+            # A zero norm means every weight of the doc is zero: leave it as is
+            norm = doc_norms.get(doc, 0.0)
+            weights.append(w_td / norm if norm > 0 else w_td)
+        postings[term] = (nums, weights)
+    packed = vsm_index["_packed"] = {"doc_names": doc_names, "postings": postings}
+    return packed
+
+class _SidecarPostings:
+    """
+    term -> (doc numbers, normalized weights) read on demand from the arrays of
+    vsm.bin (starting at byte `base`), so only the postings of terms that queries
+    use are ever decoded. Picklable (the mmap is reopened after unpickling) for
+    spawned pool workers.
+    """
+
+    def __init__(self, path: str, terms: dict, base: int):
+        self.path = path
+        self.terms = terms
+        self.base = base
+        self._mm = None
+        self._cache = {}
+
+    def __getstate__(self):
+        return {"path": self.path, "terms": self.terms, "base": self.base, "_mm": None, "_cache": {}}
+
+    def __contains__(self, term) -> bool:
+        return term in self.terms
+
+    def __getitem__(self, term):
+        entry = self._cache.get(term)
+        if entry is None:
+            offset, n = self.terms[term]
+            offset += self.base
+            if self._mm is None:
+                with open(self.path, "rb") as f:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            nums = array("i")
+            weights = array("d")
+            mid = offset + nums.itemsize * n
+            nums.frombytes(self._mm[offset:mid])
+            weights.frombytes(self._mm[mid:mid + weights.itemsize * n])
+            entry = self._cache[term] = (nums, weights)
+        return entry
+
+def load_vsm_index(index_dir: str) -> dict:
+    """
+    Load the VSM index from index_dir. When Task 1's binary sidecar vsm.bin is
+    present, matches this machine's byte order and was written from this
+    vsm.json, the packed form is built from it directly and postings are read
+    lazily; otherwise vsm.json is parsed.
+    """
+    path = os.path.join(index_dir, "vsm.json")
+    bin_path = os.path.join(index_dir, "vsm.bin")
+    if os.path.exists(bin_path) and os.path.exists(path):
+        header = _read_sidecar_header(bin_path, VSM_MAGIC)
+        if header is not None:
+            meta, base = header
+            if meta.get("byteorder") == sys.byteorder and meta.get("vsm.json") == _file_fingerprint(path):
+                return {
+                    "idf": meta["idf"],
+                    "_packed": {
+                        "doc_names": meta["doc_names"],
+                        "postings": _SidecarPostings(bin_path, meta["terms"], base),
+                    },
+                }
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _read_sidecar_header(path: str, magic: bytes) -> Optional[Tuple[dict, int]]:
+    """(meta, byte offset of the arrays) of a sidecar written by Task 1's
+    _write_sidecar, or None if the file does not start with `magic` or is truncated."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+        if len(head) < 16 or head[:8] != magic:
+            return None
+        size = int.from_bytes(head[8:], "little")
+        data = f.read(size)
+    if len(data) < size:
+        return None
+    try:
+        meta = json.loads(data)
+    except ValueError:
+        return None
+    return meta, 16 + size
+
+def _file_fingerprint(path: str, chunk: int = 1 << 16) -> list:
+    """[size, digest of the first and last `chunk` bytes] of a file, as recorded by
+    Task 1 (build_index._file_fingerprint) for the file a sidecar was derived from."""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read())
+    return [size, h.hexdigest()]
 
 # ---------------- QUERY FUNCTION ----------------
 
@@ -32,14 +214,22 @@ def vsm_query(query: str, vsm_index: dict, k: int) -> list:
     Given a query string, return the top-k documents ranked by cosine similarity
     using log-normalized TF-IDF weighting.
     """
-    nlp = _init_tokenizer()
+    return vsm_query_tokens(_tokenize_spacy_raw(_init_tokenizer(), query), vsm_index, k)
+
+
+def vsm_query_tokens(tokens: List[str], vsm_index: dict, k: int) -> list:
+    """
+    Same as vsm_query, for a query that is already tokenized (e.g. by the batched
+    nlp.pipe pass in vsm()), so it is not run through spaCy a second time.
+    """
     idf = vsm_index["idf"]
-    doc_norms = vsm_index["doc_norms"]
-    postings = vsm_index["postings"]
+    packed = _packed_index(vsm_index)
+    doc_names = packed["doc_names"]
+    postings = packed["postings"]
 
     # 1. Build query term frequency
     q_tf = defaultdict(int)
-    for token in _tokenize_spacy_raw(nlp, query):
+    for token in tokens:
         if token in idf:  # only terms in vocab
             q_tf[token] += 1
 
@@ -51,107 +241,134 @@ def vsm_query(query: str, vsm_index: dict, k: int) -> list:
     for term, tf in q_tf.items():
         q_weights[term] = (1 + math.log(tf)) * idf[term]
 
-    # 3. Compute scores for docs
-    scores = defaultdict(float)
+    # 3. Compute scores for docs (keyed by doc number); the packed weights are
+    # already divided by the doc norm. A plain dict with a bound get() is cheaper
+    # per posting than defaultdict's __missing__ and keeps first-touch order
+    scores = {}
+    get = scores.get
     for term, w_tq in q_weights.items():
         if term not in postings:
             continue
-        for doc, tf in postings[term].items():
-            w_td = (1 + math.log(tf)) * idf[term]
-            scores[doc] += w_tq * w_td
+        nums, weights = postings[term]
+        for i, w in zip(nums, weights):
+            scores[i] = get(i, 0.0) + w_tq * w
 
-    # 4. Normalize by doc norms and query norm
+    # 4. Normalize by the query norm
     q_norm = math.sqrt(sum(w**2 for w in q_weights.values()))
-    for doc in list(scores.keys()):
-        if doc in doc_norms and doc_norms[doc] > 0 and q_norm > 0:
-            scores[doc] /= (doc_norms[doc] * q_norm)
+    if q_norm > 0:
+        for i in scores:
+            scores[i] /= q_norm
+
+    # 5. Select top-k (nlargest keeps sorted(..., reverse=True)[:k] order, ties included)
+    ranked = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+    return [(doc_names[i], score) for i, score in ranked]
+
+# ---------------- PARALLEL QUERIES ----------------
+
+# Per-worker state for _rank_parallel, set by the pool initializer
+_W_VSM_INDEX = None
+_W_K = None
+
+def _init_rank_worker(vsm_index: dict, k: int):
+    """Pool initializer: keep the index (inherited, not copied, when forked)."""
+    global _W_VSM_INDEX, _W_K
+    _W_VSM_INDEX = vsm_index
+    _W_K = k
 
-    # 5. Sort and return top-k
-    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return ranked[:k]
+def _rank_worker(item):
+    qid, tokens = item
+    return qid, vsm_query_tokens(tokens, _W_VSM_INDEX, _W_K)
+
+def _pool_context():
+    """
+    Prefer fork where the platform has it (Linux/macOS), so workers inherit the
+    loaded index copy-on-write; elsewhere it is pickled to each worker.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+def _rank_parallel(vsm_index: dict, queries: list, k: int) -> list:
+    """Rank (qid, tokens) pairs with a pool of workers; results keep query order."""
+    if len(queries) < 2:
+        return [(qid, vsm_query_tokens(tokens, vsm_index, k)) for qid, tokens in queries]
+    # Pack before forking so the workers share one copy of the arrays
+    _packed_index(vsm_index)
+    processes = min(QUERY_PROCESSES, len(queries))
+    with _pool_context().Pool(processes=processes, initializer=_init_rank_worker, initargs=(vsm_index, k)) as pool:
+        return pool.map(_rank_worker, queries, chunksize=max(1, len(queries) // (processes * 4)))
 
 # ---------------- MULTI-QUERY DRIVER ----------------
 
+def _open_text(path: str):
+    """Open a text file for reading: UTF-16 when it starts with a UTF-16 BOM, else UTF-8."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+    if head in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return open(path, "r", encoding="utf-16")
+    return open(path, "r", encoding="utf-8-sig")
+
+def _query_from_obj(obj, fields: List[str]) -> Optional[Tuple[str, str]]:
+    """(qid, text) for one query object, joining the chosen text fields; None if it has no text."""
+    if not isinstance(obj, dict):
+        return None
+    qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
+
+    # Concatenate chosen fields
+    text_parts = []
+    for field in fields:
+        if obj.get(field):
+            text_parts.append(str(obj[field]))
+    q = " ".join(text_parts)
+
+    if not q:
+        return None
+    return (str(qid) if qid != "" else q[:30], q)
+
+
 def _read_queries_json(path: str, fields: Optional[List[str]] = None):
     """Read queries in flexible JSON/JSONL formats.
     Accepts entries with keys: (query_id|qid|id) and various text fields.
-    Yields (qid, text).
+    Yields (qid, text). The encoding is picked once from the BOM and JSON-lines
+    files are parsed lazily, one line at a time.
     """
     if fields is None:
         fields = ["title"]  # Only use title field by default
-    
-    try:
-        with open(path, "r", encoding="utf-16") as f:
-            content = f.read().strip()
-    except UnicodeDecodeError:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-    if not content:
-        return []
-    lines = content.splitlines()
-    if len(lines) > 1:
-        out = []
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            
-            # Concatenate chosen fields
-            text_parts = []
-            for field in fields:
-                if obj.get(field):
-                    text_parts.append(str(obj[field]))
-            q = " ".join(text_parts)
-            
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
-        return out
+
+    with _open_text(path) as f:
+        lines = (line.strip() for line in f)
+        first = next((line for line in lines if line), None)
+        if first is None:
+            return
+        second = next((line for line in lines if line), None)
+        if second is not None:
+            for line in chain((first, second), lines):
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                query = _query_from_obj(obj, fields)
+                if query:
+                    yield query
+            return
     # else single JSON object/array
     try:
-        data = json.loads(content)
+        data = json.loads(first)
     except json.JSONDecodeError:
-        return []
-    out = []
+        return
+    if isinstance(data, dict) and isinstance(data.get("queries"), list):
+        data = data["queries"]
     if isinstance(data, list):
         for obj in data:
-            if not isinstance(obj, dict):
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            
-            # Concatenate chosen fields
-            text_parts = []
-            for field in fields:
-                if obj.get(field):
-                    text_parts.append(str(obj[field]))
-            q = " ".join(text_parts)
-            
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
+            query = _query_from_obj(obj, fields)
+            if query:
+                yield query
     elif isinstance(data, dict):
-        if "queries" in data and isinstance(data["queries"], list):
-            for obj in data["queries"]:
-                if not isinstance(obj, dict):
-                    continue
-                qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-                
-                # Concatenate chosen fields
-                text_parts = []
-                for field in fields:
-                    if obj.get(field):
-                        text_parts.append(str(obj[field]))
-                q = " ".join(text_parts)
-                
-                if q:
-                    out.append((str(qid) if qid != "" else q[:30], q))
-        else:
-            for k, v in data.items():
-                out.append((str(k), str(v)))
-    return out
+        # mapping id->text
+        for k, v in data.items():
+            yield (str(k), str(v))
 
 
 def vsm(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: str, fields: Optional[List[str]] = None) -> None:
@@ -165,8 +382,7 @@ def vsm(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: str
         fields = ["title"]  # Only use title field by default
 
     # load vsm index
-    with open(os.path.join(index_dir, "vsm.json"), "r", encoding="utf-8") as f:
-        vsm_index = json.load(f)
+    vsm_index = load_vsm_index(index_dir)
 
     # load stopwords
     stopwords = set()
@@ -179,17 +395,25 @@ def vsm(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: str
     os.makedirs(os.path.dirname(outFile), exist_ok=True)
 
     nlp = _init_tokenizer()
-    queries = list(_read_queries_json(queryFile, fields))
-    
-    with open(outFile, "w", encoding="utf-8") as out:
-        for qid, text in queries:
+
+    def clean_queries():
+        # Queries are streamed from the file, not collected into a list first,
+        # and tokenized QUERY_BATCH_SIZE at a time
+        queries = _read_queries_json(queryFile, fields)
+        while True:
+            batch = list(islice(queries, QUERY_BATCH_SIZE))
+            if not batch:
+                return
             # dont Filter stopwords
-            tokens = [tok for tok in _tokenize_spacy_raw(nlp, text)]
-            # tokens = [tok for tok in _tokenize_spacy_raw(nlp, text) if tok not in stopwords]
-            clean_query = " ".join(tokens)
+            yield from zip((qid for qid, _ in batch), _tokenize_queries(nlp, [text for _, text in batch]))
 
-            ranked = vsm_query(clean_query, vsm_index, k)
+    if QUERY_PROCESSES > 1:
+        results = _rank_parallel(vsm_index, list(clean_queries()), k)
+    else:
+        results = ((qid, vsm_query_tokens(tokens, vsm_index, k)) for qid, tokens in clean_queries())
 
+    with open(outFile, "w", encoding="utf-8") as out:
+        for qid, ranked in results:
             # Write: qid docid rank score (space-separated like BM25)
             for rank, (doc, score) in enumerate(ranked, start=1):
                 out.write(f"{qid} {doc} {rank} {score:.4f}\n")
@@ -22,6 +22,13 @@ import os
 import sys
 import json
 import math
+import hashlib
+import heapq
+import mmap
+import codecs
+from array import array
+from collections.abc import Mapping
+from itertools import chain
 from typing import Dict, List, Tuple, Iterable, Optional
 
 try:
@@ -31,6 +38,8 @@ except ImportError as e:
         "spaCy is required. Install with: pip install spacy"
     ) from e
 
+# First bytes of Task 1's bm25.bin sidecar (see build_index._write_sidecar)
+BM25_MAGIC = b"A2BM25\x00\x01"
 
 # ---------------- I/O helpers ----------------
 
@@ -44,97 +53,250 @@ def _load_bm25(index_dir: str) -> Dict:
         return json.load(f)
 
 
+class _LazyLexicon(Mapping):
+    """index.json as a read-only mapping that is parsed only if something reads it."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self._lex = None
+
+    def _load(self) -> Dict[str, dict]:
+        if self._lex is None:
+            self._lex = _load_index(self.index_dir)
+        return self._lex
+
+    def __getitem__(self, term):
+        return self._load()[term]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+class _SidecarTerms:
+    """
+    term -> (df, doc numbers, tfs) read on demand from the arrays of bm25.bin
+    (written by Task 1, starting at byte `base`), so only the postings of query
+    terms are ever decoded. Picklable (the mmap is reopened after unpickling) for
+    spawned worker processes.
+    """
+
+    def __init__(self, path: str, terms: Dict[str, list], base: int):
+        self.path = path
+        self.terms = terms
+        self.base = base
+        self._mm = None
+        self._cache: Dict[str, tuple] = {}
+
+    def __getstate__(self):
+        return {"path": self.path, "terms": self.terms, "base": self.base, "_mm": None, "_cache": {}}
+
+    def __contains__(self, term) -> bool:
+        return term in self.terms
+
+    def get(self, term, default=None):
+        entry = self._cache.get(term)
+        if entry is not None:
+            return entry
+        span = self.terms.get(term)
+        if span is None:
+            return default
+        offset, n, df = span
+        offset += self.base
+        if self._mm is None:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        nums = array("i")
+        tfs = array("i")
+        mid = offset + nums.itemsize * n
+        nums.frombytes(self._mm[offset:mid])
+        tfs.frombytes(self._mm[mid:mid + tfs.itemsize * n])
+        entry = self._cache[term] = (df, nums, tfs)
+        return entry
+
+
+def load_bm25_index(index_dir: str) -> Dict:
+    """Load index.json and bm25.json into the combined index object bm25_query expects.
+
+    When Task 1's binary sidecar bm25.bin is present, matches this machine's byte
+    order and was written with this bm25.json and index.json, the packed postings
+    come from it and index.json is only parsed if "lexicon" is actually read.
+    """
+    bm = _load_bm25(index_dir)
+    bin_path = os.path.join(index_dir, "bm25.bin")
+    if os.path.exists(bin_path):
+        header = _read_sidecar_header(bin_path, BM25_MAGIC)
+        if header is not None and _sidecar_is_current(header[0], bm, index_dir):
+            meta, base = header
+            return {
+                "lexicon": _LazyLexicon(index_dir),
+                "bm25": bm,
+                "_packed": {"doc_names": meta["doc_names"], "terms": _SidecarTerms(bin_path, meta["terms"], base)},
+            }
+    return {"lexicon": _load_index(index_dir), "bm25": bm}
+
+
+def _read_sidecar_header(path: str, magic: bytes) -> Optional[Tuple[dict, int]]:
+    """(meta, byte offset of the arrays) of a sidecar written by Task 1's
+    _write_sidecar, or None if the file does not start with `magic` or is truncated."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+        if len(head) < 16 or head[:8] != magic:
+            return None
+        size = int.from_bytes(head[8:], "little")
+        data = f.read(size)
+    if len(data) < size:
+        return None
+    try:
+        meta = json.loads(data)
+    except ValueError:
+        return None
+    return meta, 16 + size
+
+
+def _sidecar_is_current(meta: dict, bm: Dict, index_dir: str) -> bool:
+    """True when bm25.bin was written in the same build as the JSON files next to it."""
+    index_path = os.path.join(index_dir, "index.json")
+    return (
+        meta.get("byteorder") == sys.byteorder
+        and meta.get("N") == bm.get("N")
+        and meta.get("n_docs") == len(bm.get("doc_len", {}))
+        and meta.get("bm25.json") == _file_fingerprint(os.path.join(index_dir, "bm25.json"))
+        and meta.get("index.json") == (_file_fingerprint(index_path) if os.path.exists(index_path) else None)
+    )
+
+
+def _file_fingerprint(path: str, chunk: int = 1 << 16) -> list:
+    """[size, digest of the first and last `chunk` bytes] of a file, as recorded by
+    Task 1 (build_index._file_fingerprint) for the files a sidecar was derived from."""
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read())
+    return [size, h.hexdigest()]
+
+
+def _with_hyperparams(index: Dict, k1: Optional[float], b: Optional[float]) -> Dict:
+    """Shallow copy of a combined index whose (k1, b) override the values from bm25.json.
+    A None value keeps the stored setting."""
+    bm = dict(index["bm25"])
+    hp = dict(bm.get("hyperparams", {}))
+    if k1 is not None:
+        hp["k1"] = float(k1)
+    if b is not None:
+        hp["b"] = float(b)
+    bm["hyperparams"] = hp
+    # The packed postings do not depend on (k1, b): build them once on `index` and share
+    return {"lexicon": index["lexicon"], "bm25": bm, "_packed": _packed_postings(index)}
+
+
+# Built on first use and shared by every query and driver (see _init_tokenizer)
+_NLP = None
+
+
 def _init_tokenizer():
-    nlp = spacy.blank("en")
-    nlp.max_length = 300_000_000
-    return nlp
+    global _NLP
+    if _NLP is None:
+        nlp = spacy.blank("en")
+        nlp.max_length = 300_000_000
+        _NLP = nlp
+    return _NLP
 
 
 def _tokenize(nlp, text: str) -> List[str]:
-    doc = nlp(text if isinstance(text, str) else str(text))
+    # The blank pipeline has no components, so call its tokenizer directly and skip
+    # Language.__call__'s pipeline dispatch
+    doc = nlp.tokenizer(text if isinstance(text, str) else str(text))
     return [t.text for t in doc if not t.is_space]
 
 
+QUERY_BATCH_SIZE = 256
+
+
+def _tokenize_queries(queries: Iterable[Tuple[str, str]]) -> Iterable[Tuple[str, List[str]]]:
+    """(qid, text) -> (qid, tokens), tokenizing with one spaCy pipe over all queries
+    instead of one nlp() call per query."""
+    nlp = _init_tokenizer()
+    texts = ((text if isinstance(text, str) else str(text), qid) for qid, text in queries)
+    for doc, qid in nlp.pipe(texts, as_tuples=True, batch_size=QUERY_BATCH_SIZE):
+        yield qid, [t.text for t in doc if not t.is_space]
+
+
+def _open_text(path: str):
+    """Open a text file for reading: UTF-16 when it starts with a UTF-16 BOM, else UTF-8."""
+    with open(path, "rb") as f:
+        head = f.read(2)
+    if head in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return open(path, "r", encoding="utf-16")
+    return open(path, "r", encoding="utf-8-sig")
+
+
+def _query_from_obj(obj, fields: List[str]) -> Optional[Tuple[str, str]]:
+    """(qid, text) for one query object, joining the chosen text fields; None if it has no text."""
+    if not isinstance(obj, dict):
+        return None
+    qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
+
+    # Concatenate chosen fields
+    text_parts = []
+    for field in fields:
+        if obj.get(field):
+            text_parts.append(str(obj[field]))
+    q = " ".join(text_parts)
+
+    if not q:
+        return None
+    return (str(qid) if qid != "" else q[:30], q)
+
+
 def _read_queries_json(path: str, fields: Optional[List[str]] = None) -> Iterable[Tuple[str, str]]:
     """Read queries in flexible JSON/JSONL formats.
     Accepts entries with keys: (query_id|qid|id) and various text fields.
-    Yields (qid, text).
+    Yields (qid, text). The encoding is picked once from the BOM and JSON-lines
+    files are parsed lazily, one line at a time.
     """
     if fields is None:
         fields = ["title"]  # Only use title field by default
-    
-    try:
-        with open(path, "r", encoding="utf-16") as f:
-            content = f.read().strip()
-    except UnicodeDecodeError:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-    if not content:
-        return []
-    lines = content.splitlines()
-    if len(lines) > 1:
-        out = []
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            
-            # Concatenate chosen fields
-            text_parts = []
-            for field in fields:
-                if obj.get(field):
-                    text_parts.append(str(obj[field]))
-            q = " ".join(text_parts)
-            
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
-        return out
+
+    with _open_text(path) as f:
+        lines = (line.strip() for line in f)
+        first = next((line for line in lines if line), None)
+        if first is None:
+            return
+        second = next((line for line in lines if line), None)
+        if second is not None:
+            for line in chain((first, second), lines):
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                query = _query_from_obj(obj, fields)
+                if query:
+                    yield query
+            return
     # else single JSON object/array
     try:
-        data = json.loads(content)
+        data = json.loads(first)
     except json.JSONDecodeError:
-        return []
-    out = []
+        return
+    if isinstance(data, dict) and isinstance(data.get("queries"), list):
+        data = data["queries"]
     if isinstance(data, list):
         for obj in data:
-            if not isinstance(obj, dict):
-                continue
-            qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-            
-            # Concatenate chosen fields
-            text_parts = []
-            for field in fields:
-                if obj.get(field):
-                    text_parts.append(str(obj[field]))
-            q = " ".join(text_parts)
-            
-            if q:
-                out.append((str(qid) if qid != "" else q[:30], q))
+            query = _query_from_obj(obj, fields)
+            if query:
+                yield query
     elif isinstance(data, dict):
-        if "queries" in data and isinstance(data["queries"], list):
-            for obj in data["queries"]:
-                if not isinstance(obj, dict):
-                    continue
-                qid = obj.get("query_id") or obj.get("qid") or obj.get("id") or ""
-                
-                # Concatenate chosen fields
-                text_parts = []
-                for field in fields:
-                    if obj.get(field):
-                        text_parts.append(str(obj[field]))
-                q = " ".join(text_parts)
-                
-                if q:
-                    out.append((str(qid) if qid != "" else q[:30], q))
-        else:
-            for k, v in data.items():
-                out.append((str(k), str(v)))
-    return out
+        # mapping id->text
+        for k, v in data.items():
+            yield (str(k), str(v))
 
 
 # ---------------- Core BM25 ----------------
@@ -145,6 +307,63 @@ def _bm25_idf(N: int, df: int) -> float:
     return val if val > 0 else 0.0
 
 
+def _packed_postings(index: Dict) -> Dict:
+    """
+    Array form of the lexicon, built once and kept under index["_packed"]: docs are
+    numbered (bm25.json's doc_len order first) and each term becomes
+    (df, doc numbers, tfs) with the two lists as parallel array('i')s. Postings
+    with tf <= 0 are dropped here rather than skipped on every query.
+    """
+    packed = index.get("_packed")
+    if packed is not None:
+        return packed
+    doc_names = list(index["bm25"].get("doc_len", {}))
+    doc_num = {doc: i for i, doc in enumerate(doc_names)}
+    terms = {}
+    for term, term_entry in index["lexicon"].items():
+        nums = array("i")
+        tfs = array("i")
+        for doc_id, entry in term_entry.get("postings", {}).items():
+            tf = int(entry.get("tf", 0))
+            if tf <= 0:
+                continue
+            i = doc_num.get(doc_id)
+            if i is None:
+                i = doc_num[doc_id] = len(doc_names)
+                doc_names.append(doc_id)
+            nums.append(i)
+            tfs.append(tf)
+        terms[term] = (int(term_entry.get("df", 0)), nums, tfs)
+    packed = index["_packed"] = {"doc_names": doc_names, "terms": terms}
+    return packed
+
+
+def _doc_length_norms(index: Dict, k1: float, b: float, cache: bool = True) -> array:
+    """Per-document K_d = k1 * max((1 - b) + b * len_d / avgdl, 1e-9), the tf-independent
+    part of the BM25 denominator, indexed by packed doc number (len_d = 0 for docs
+    missing from doc_len). With cache=True the array for the last (k1, b) is kept on
+    the combined index object, so every query of a run reuses it."""
+    key = (k1, b)
+    hit = index.get("_doc_norms")
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    avgdl = float(index["bm25"].get("avgdl", 0.0))
+
+    def K(len_d: int) -> float:
+        denom_extra = (1 - b)
+        if avgdl > 0:
+            denom_extra += b * (len_d / avgdl)
+        # guard against denominator being zero
+        return k1 * max(denom_extra, 1e-9)
+
+    doc_len = index["bm25"].get("doc_len", {})
+    doc_names = _packed_postings(index)["doc_names"]
+    norms = array("d", (K(int(doc_len.get(doc_id, 0))) for doc_id in doc_names))
+    if cache:
+        index["_doc_norms"] = (key, norms)
+    return norms
+
+
 def bm25_query(query: str, index: object, k: int) -> list:
     """Given the raw query string and a combined index object, return top-k (docid, score).
 
@@ -152,59 +371,77 @@ def bm25_query(query: str, index: object, k: int) -> list:
       - "lexicon": index.json dictionary
       - "bm25":    bm25.json dictionary
     """
+    nlp = _init_tokenizer()
+    return bm25_query_tokens(_tokenize(nlp, query), index, k)
+
+
+def bm25_query_tokens(q_tokens: List[str], index: object, k: int) -> list:
+    """bm25_query for an already tokenized query."""
     if not isinstance(index, dict) or "lexicon" not in index or "bm25" not in index:
         raise ValueError("index must be a dict with keys 'lexicon' and 'bm25'")
 
-    lex = index["lexicon"]
     bm = index["bm25"]
     N = int(bm.get("N", 0))
-    avgdl = float(bm.get("avgdl", 0.0))
-    doc_len = bm.get("doc_len", {})
     hp = bm.get("hyperparams", {})
     k1 = float(hp.get("k1", 1.5))
     b = float(hp.get("b", 0.75))
+    k1p1 = k1 + 1.0
 
-    nlp = _init_tokenizer()
-    q_tokens = _tokenize(nlp, query)
     if not q_tokens or N <= 0:
         return []
 
-    # Unique terms; k3=0 (ignore query tf weighting)
-    seen = set()
-    scores: Dict[str, float] = {}
-    for t in q_tokens:
-        if t in seen:
-            continue
-        seen.add(t)
-        term_entry = lex.get(t)
-        if not term_entry:
-            continue
-        df = int(term_entry.get("df", 0))
-        if df <= 0:
-            continue
-        idf = _bm25_idf(N, df)
-        if idf <= 0.0:
-            continue
-        postings = term_entry.get("postings", {})
-        for doc_id, entry in postings.items():
-            tf = int(entry.get("tf", 0))
-            if tf <= 0:
+    packed = _packed_postings(index)
+    terms = packed["terms"]
+    # Per-term contributions for this (k1, b), shared by every query of the run
+    key = (k1, b)
+    cached = index.get("_term_contrib")
+    if cached is None or cached[0] != key:
+        cached = index["_term_contrib"] = (key, {})
+    contrib_cache = cached[1]
+    K = None
+
+    # Unique terms; k3=0 (ignore query tf weighting). dict.fromkeys keeps first-seen
+    # order, so scores are summed in the same order as the query text. A plain dict
+    # with a bound get() is cheaper per posting than defaultdict(float)
+    scores: Dict[int, float] = {}  # keyed by packed doc number
+    get = scores.get
+    for t in dict.fromkeys(q_tokens):
+        contrib = contrib_cache.get(t)
+        if contrib is None:
+            term_entry = terms.get(t)
+            if not term_entry:
+                continue
+            df, nums, tfs = term_entry
+            if df <= 0:
+                continue
+            idf = _bm25_idf(N, df)
+            if idf <= 0.0:
                 continue
-            len_d = int(doc_len.get(doc_id, 0))
-            denom_extra = (1 - b)
-            if avgdl > 0:
-                denom_extra += b * (len_d / avgdl)
-            # guard against denominator being zero
-            denom = tf + k1 * max(denom_extra, 1e-9)
-            norm = (tf * (k1 + 1.0)) / denom
-            scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+            if K is None:
+                K = _doc_length_norms(index, k1, b)
+            # idf * norm per posting, exactly as it is added to the score
+            contrib = contrib_cache[t] = (
+                nums,
+                array("d", [idf * ((tf * k1p1) / (tf + K[i])) for i, tf in zip(nums, tfs)]),
+            )
+        for i, c in zip(*contrib):
+            scores[i] = get(i, 0.0) + c
 
     if not scores:
         return []
 
-    # sort by score desc then docid asc; take top-k
-    items = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
-    return items[:k]
+    # top-k by score desc then docid asc; nsmallest is sorted(...)[:k] without the full sort
+    doc_names = packed["doc_names"]
+    top = heapq.nsmallest(k, scores.items(), key=lambda kv: (-kv[1], doc_names[kv[0]]))
+    return [(doc_names[i], score) for i, score in top]
+
+
+def _write_run(queries: Iterable[Tuple[str, str]], combo: Dict, k: int, outFile: str) -> None:
+    with open(outFile, "w", encoding="utf-8") as out:
+        for qid, q_tokens in _tokenize_queries(queries):
+            results = bm25_query_tokens(q_tokens, combo, k)
+            for rank, (doc_id, score) in enumerate(results, start=1):
+                out.write(f"{qid} {doc_id} {rank} {score}\n")
 
 
 def bm25(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: str, fields: Optional[List[str]] = None) -> None:
@@ -216,15 +453,97 @@ def bm25(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: st
     if fields is None:
         fields = ["title"]  # Only use title field by default
         
-    lex = _load_index(index_dir)
-    bm = _load_bm25(index_dir)
-    combo = {"lexicon": lex, "bm25": bm}
-    queries = list(_read_queries_json(queryFile, fields))
-    with open(outFile, "w", encoding="utf-8") as out:
-        for qid, text in queries:
-            results = bm25_query(text, combo, k)
-            for rank, (doc_id, score) in enumerate(results, start=1):
-                out.write(f"{qid} {doc_id} {rank} {score}\n")
+    combo = load_bm25_index(index_dir)
+    _write_run(_read_queries_json(queryFile, fields), combo, k, outFile)
+
+
+def bm25_with_params(queryFile: str, index_dir: str, stopword_file: str, k: int, outFile: str,
+                     k1: float, b: float, index: Optional[Dict] = None,
+                     fields: Optional[List[str]] = None) -> None:
+    """Same as bm25(), but (k1, b) are passed in instead of read from bm25.json.
+
+    If `index` (from load_bm25_index) is given, index_dir is not re-read; this lets
+    a hyperparameter sweep load the index once and never rewrite bm25.json.
+    """
+    if fields is None:
+        fields = ["title"]  # Only use title field by default
+
+    if index is None:
+        index = load_bm25_index(index_dir)
+    combo = _with_hyperparams(index, k1, b)
+    _write_run(_read_queries_json(queryFile, fields), combo, k, outFile)
+
+
+def bm25_return(queryFile: str, index_dir: str, k: int, k1: Optional[float] = None,
+                b: Optional[float] = None, index: Optional[Dict] = None,
+                fields: Optional[List[str]] = None) -> Dict[str, List[Tuple[str, int, float]]]:
+    """In-memory variant of bm25(): no output file is written.
+
+    Returns dict[qid] -> list of (docid, rank, score) in rank order, the same shape
+    evaluate_ir.load_run_trec produces, so callers can evaluate without a disk round-trip.
+    """
+    if fields is None:
+        fields = ["title"]  # Only use title field by default
+
+    if index is None:
+        index = load_bm25_index(index_dir)
+    combo = _with_hyperparams(index, k1, b)
+    run: Dict[str, List[Tuple[str, int, float]]] = {}
+    for qid, q_tokens in _tokenize_queries(_read_queries_json(queryFile, fields)):
+        results = bm25_query_tokens(q_tokens, combo, k)
+        run[qid] = [(doc_id, rank, score) for rank, (doc_id, score) in enumerate(results, start=1)]
+    return run
+
+
+def bm25_batch(queryFile: str, index_dir: str, k: int, params_list: List[Tuple[float, float]],
+               index: Optional[Dict] = None,
+               fields: Optional[List[str]] = None) -> List[Dict[str, List[Tuple[str, int, float]]]]:
+    """Score several (k1, b) settings in a single pass over the index.
+
+    Queries are read and tokenized once, and each posting list is walked once per
+    query term; inside that walk every setting's BM25 formula is applied. Scores are
+    identical to running bm25_query once per setting.
+    Returns one run per entry of params_list, each shaped like bm25_return's result.
+    """
+    if fields is None:
+        fields = ["title"]  # Only use title field by default
+
+    if index is None:
+        index = load_bm25_index(index_dir)
+    bm = index["bm25"]
+    N = int(bm.get("N", 0))
+    settings = [(float(k1), float(b)) for k1, b in params_list]
+    packed = _packed_postings(index)
+    terms = packed["terms"]
+    doc_names = packed["doc_names"]
+    # (k1 + 1, K_d by doc number) per setting
+    consts = [(k1 + 1.0, _doc_length_norms(index, k1, b, cache=False)) for k1, b in settings]
+
+    runs: List[Dict[str, List[Tuple[str, int, float]]]] = [{} for _ in settings]
+    for qid, q_tokens in _tokenize_queries(_read_queries_json(queryFile, fields)):
+        # Plain dicts with bound get()s, as in bm25_query_tokens
+        scores: List[Dict[int, float]] = [{} for _ in settings]
+        slots = [(k1p1, K, sc, sc.get) for (k1p1, K), sc in zip(consts, scores)]
+        if q_tokens and N > 0:
+            for t in dict.fromkeys(q_tokens):
+                term_entry = terms.get(t)
+                if not term_entry:
+                    continue
+                df, nums, tfs = term_entry
+                if df <= 0:
+                    continue
+                idf = _bm25_idf(N, df)
+                if idf <= 0.0:
+                    continue
+                for i, tf in zip(nums, tfs):
+                    for k1p1, K, sc, get in slots:
+                        denom = tf + K[i]
+                        norm = (tf * k1p1) / denom
+                        sc[i] = get(i, 0.0) + idf * norm
+        for run, sc in zip(runs, scores):
+            top = heapq.nsmallest(k, sc.items(), key=lambda kv: (-kv[1], doc_names[kv[0]]))
+            run[qid] = [(doc_names[i], rank, score) for rank, (i, score) in enumerate(top, start=1)]
+    return runs
 
 
 def main(argv: List[str]) -> int:
@@ -0,0 +1,88 @@
+"""
+evaluate_once memoization in Scoring/bm25_tuner.py. The tuner reads its paths from
+module constants relative to the working directory, so the test lays out a small
+project (fixture index, queries, qrels) in a temporary directory and imports the
+tuner from there.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "tests", "data")
+
+
+class EvaluateOnceMemoTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.mkdtemp(prefix="a2_tuner_")
+        corpus = os.path.join(DATA, "corpus")
+        vocab_dir = os.path.join(cls.tmp, "temp")
+        subprocess.run([sys.executable, os.path.join(ROOT, "Task0/tokenize_corpus.py"), corpus, "none", vocab_dir],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([sys.executable, os.path.join(ROOT, "Task1/build_index.py"), corpus,
+                        os.path.join(vocab_dir, "vocab.txt"), os.path.join(vocab_dir, "out_index")],
+                       check=True, stdout=subprocess.DEVNULL)
+        os.makedirs(os.path.join(cls.tmp, "Data", "CORD19"))
+        shutil.copy(os.path.join(DATA, "queries.json"), os.path.join(cls.tmp, "Data", "CORD19", "queries.json"))
+        os.makedirs(os.path.join(cls.tmp, "Task4"))
+        shutil.copy(os.path.join(ROOT, "Task4", "bm25_retrieval.py"), os.path.join(cls.tmp, "Task4"))
+        os.makedirs(os.path.join(cls.tmp, "Scoring"))
+        shutil.copy(os.path.join(ROOT, "Scoring", "evaluate_ir.py"), os.path.join(cls.tmp, "Scoring"))
+        with open(os.path.join(cls.tmp, "Scoring", "qrels.json"), "w", encoding="utf-8") as f:
+            for qid, doc in (("1", "d001"), ("2", "d010"), ("5", "d020")):
+                f.write(json.dumps({"query_id": qid, "doc_id": doc, "relevance": 1}) + "\n")
+
+        os.chdir(cls.tmp)
+        spec = importlib.util.spec_from_file_location("bm25_tuner", os.path.join(ROOT, "Scoring", "bm25_tuner.py"))
+        cls.tuner = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.tuner)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.tuner._RUN_WRITER is not None:
+            cls.tuner._RUN_WRITER.shutdown(wait=True)
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def setUp(self):
+        # Count BM25 runs; both entry points end up here or in bm25_batch
+        self.calls = []
+        bm25_mod = self.tuner.bm25_mod
+        original = bm25_mod.bm25_return
+
+        def counting(*args, **kwargs):
+            self.calls.append((kwargs.get("k1"), kwargs.get("b")))
+            return original(*args, **kwargs)
+
+        bm25_mod.bm25_return = counting
+        self.addCleanup(setattr, bm25_mod, "bm25_return", original)
+
+    def test_duplicate_after_rounding_does_not_rerun_bm25(self):
+        first = self.tuner.evaluate_once({"k": 20, "k1": 1.20001, "b": 0.30001}, trial_id=1)
+        # Differs past the 4th decimal (and past _RUN_CACHE's 6-decimal key too)
+        second = self.tuner.evaluate_once({"k": 20, "k1": 1.200042, "b": 0.299996}, trial_id=2)
+        self.assertEqual(len(self.calls), 1)
+        # The memoized result, including the first trial's run file
+        self.assertEqual(second, first)
+        self.assertIn("run_trial1_", second[1])
+
+    def test_distinct_settings_are_evaluated(self):
+        self.tuner.evaluate_once({"k": 20, "k1": 0.9, "b": 0.1}, trial_id=3)
+        self.tuner.evaluate_once({"k": 20, "k1": 0.9001, "b": 0.1}, trial_id=4)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_eval_key_quantizes_to_four_decimals(self):
+        key = self.tuner.eval_key
+        self.assertEqual(key({"k": 20, "k1": 1.23454, "b": 0.1}), key({"k": "20", "k1": "1.2345", "b": "0.10004"}))
+        self.assertNotEqual(key({"k": 20, "k1": 1.2345, "b": 0.1}), key({"k": 20, "k1": 1.2346, "b": 0.1}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""evaluate_with_early_stop's bound and the qrels / run readers in Scoring/evaluate_ir.py."""
+import os
+import random
+import tempfile
+import unittest
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_from_path(module_name, path):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+evaluate_ir = _import_from_path("evaluate_ir", "Scoring/evaluate_ir.py")
+
+MACRO = {"macro_p": 0, "macro_r": 1, "macro_f1": 2}
+
+
+class EarlyStopTest(unittest.TestCase):
+    def random_case(self, rng):
+        docs = [f"d{i}" for i in range(30)]
+        qids = [str(q) for q in range(rng.randint(1, 12))]
+        qrels = {q: set(rng.sample(docs, rng.randint(0, 6))) for q in qids}
+        run = {q: [(d, r, 1.0 / r) for r, d in enumerate(rng.sample(docs, rng.randint(0, 10)), start=1)]
+               for q in qids if rng.random() < 0.9}
+        return qrels, run
+
+    def test_bound_holds(self):
+        rng = random.Random(21)
+        for _ in range(2000):
+            qrels, run = self.random_case(rng)
+            metric = rng.choice(sorted(MACRO))
+            per_query, macro_avg, micro_avg = evaluate_ir.evaluate(qrels, run)
+            value = macro_avg[MACRO[metric]]
+            threshold = rng.choice([value, value - 0.05, value + 0.05, rng.random()])
+            res = evaluate_ir.evaluate_with_early_stop(qrels, run, threshold, metric=metric)
+            with self.subTest(qrels=qrels, run=run, metric=metric, threshold=threshold):
+                if res is None:
+                    # Only trials that really fall short may be pruned
+                    self.assertLess(value, threshold)
+                else:
+                    # A finished evaluation is the full one
+                    self.assertEqual(res, (per_query, macro_avg, micro_avg))
+                if value >= threshold:
+                    self.assertIsNotNone(res)
+
+    def test_micro_metric_rejected(self):
+        with self.assertRaises(ValueError):
+            evaluate_ir.evaluate_with_early_stop({}, {}, 0.5, metric="micro_f1")
+
+
+class ReadTextTest(unittest.TestCase):
+    def test_qrels_in_any_encoding(self):
+        line = '{"query_id": 1, "doc_id": "dé", "relevance": 1}\n{"query_id": 2, "doc_id": "x", "relevance": 0}\n'
+        for encoding in ("utf-8", "utf-8-sig", "utf-16", "utf-16-le", "utf-16-be"):
+            with self.subTest(encoding=encoding):
+                with tempfile.NamedTemporaryFile("wb", suffix=".jsonl", delete=False) as f:
+                    f.write(line.encode(encoding))
+                try:
+                    self.assertEqual(dict(evaluate_ir.load_qrels_jsonl(f.name)), {"1": {"dé"}})
+                finally:
+                    os.remove(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
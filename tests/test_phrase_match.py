@@ -0,0 +1,116 @@
+"""phrase_match_in_doc and _phrase_search_candidates against brute-force references."""
+import os
+import random
+import unittest
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_from_path(module_name, path):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+phrase_search = _import_from_path("phrase_search", "Task2/phrase_search.py")
+
+# SHIFTED_SET_MIN_POSITIONS values that force one strategy for every input
+SHIFTED_SETS = 0
+BISECT = 10 ** 9
+
+
+def brute_force_match(positions_lists):
+    """Some p in list 0 with p + i in list i for every i."""
+    if not positions_lists:
+        return False
+    rest = [set(lst) for lst in positions_lists]
+    return any(all(p + i in rest[i] for i in range(len(rest))) for p in positions_lists[0])
+
+
+class PhraseMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(764)
+        self.addCleanup(setattr, phrase_search, "SHIFTED_SET_MIN_POSITIONS",
+                        phrase_search.SHIFTED_SET_MIN_POSITIONS)
+
+    def random_lists(self):
+        n = self.rng.randint(1, 5)
+        span = self.rng.choice([10, 40, 200])
+        return [sorted(self.rng.sample(range(span), self.rng.randint(0, min(span, 30))))
+                for _ in range(n)]
+
+    def assertMatchesBruteForce(self, threshold, trials=3000):
+        phrase_search.SHIFTED_SET_MIN_POSITIONS = threshold
+        for _ in range(trials):
+            lists = self.random_lists()
+            with self.subTest(threshold=threshold, lists=lists):
+                self.assertEqual(phrase_search.phrase_match_in_doc(lists), brute_force_match(lists))
+
+    def test_edge_cases(self):
+        match = phrase_search.phrase_match_in_doc
+        for threshold in (SHIFTED_SETS, BISECT):
+            phrase_search.SHIFTED_SET_MIN_POSITIONS = threshold
+            with self.subTest(threshold=threshold):
+                self.assertFalse(match([]))
+                self.assertFalse(match([[]]))
+                self.assertTrue(match([[3]]))
+                self.assertFalse(match([[0, 5], []]))
+                self.assertTrue(match([[0], [1], [2]]))
+                self.assertFalse(match([[1], [0]]))  # order matters
+                self.assertTrue(match([[4, 9], [5, 7], [6, 11]]))
+
+    def test_shifted_sets_match_brute_force(self):
+        self.assertMatchesBruteForce(SHIFTED_SETS)
+
+    def test_bisect_matches_brute_force(self):
+        self.assertMatchesBruteForce(BISECT)
+
+    def test_default_threshold_matches_brute_force(self):
+        # The shipped cut-off picks per doc, so both strategies run in one sweep
+        self.assertMatchesBruteForce(phrase_search.SHIFTED_SET_MIN_POSITIONS)
+
+
+class PhraseCandidatesTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(764)
+        self.addCleanup(setattr, phrase_search, "DIRECT_VERIFY_MAX_DOCS",
+                        phrase_search.DIRECT_VERIFY_MAX_DOCS)
+
+    def test_candidates_match_brute_force(self):
+        # Small positional index over random token streams
+        vocab = ["a", "b", "c", "d", "e"]
+        docs = {f"d{i}": [self.rng.choice(vocab) for _ in range(self.rng.randint(0, 30))]
+                for i in range(60)}
+        index = {}
+        for doc_id, toks in docs.items():
+            for pos, tok in enumerate(toks):
+                entry = index.setdefault(tok, {"df": 0, "postings": {}})
+                posting = entry["postings"].setdefault(doc_id, {"tf": 0, "pos": []})
+                posting["tf"] += 1
+                posting["pos"].append(pos)
+        for entry in index.values():
+            entry["df"] = len(entry["postings"])
+
+        for max_docs in (-1, 10 ** 9):  # bigram path, rare-term direct path
+            phrase_search.DIRECT_VERIFY_MAX_DOCS = max_docs
+            for _ in range(300):
+                query = [self.rng.choice(vocab + ["z"]) for _ in range(self.rng.randint(1, 4))]
+                expected = sorted(
+                    doc_id for doc_id, toks in docs.items()
+                    if any(toks[s:s + len(query)] == query for s in range(len(toks)))
+                )
+                with self.subTest(max_docs=max_docs, query=query):
+                    self.assertEqual(phrase_search._phrase_search_candidates(index, query, {}), expected)
+
+    def test_missing_or_empty_postings(self):
+        index = {"a": {"df": 1, "postings": {"d0": {"tf": 1, "pos": [0]}}},
+                 "b": {"df": 0, "postings": {}}}
+        self.assertEqual(phrase_search._phrase_search_candidates(index, [], {}), [])
+        self.assertEqual(phrase_search._phrase_search_candidates(index, ["a", "z"], {}), [])
+        self.assertEqual(phrase_search._phrase_search_candidates(index, ["a", "b", "a"], {}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""
+End-to-end checks on the small corpus in tests/data: the script outputs must not
+depend on how the work is split across processes or which optional files are
+read.
+
+Run from the repository root:  python3 -m unittest discover -s tests
+"""
+import os
+import sys
+import shutil
+import filecmp
+import tempfile
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(ROOT, "tests", "data")
+CORPUS = os.path.join(DATA, "corpus")
+QUERIES = os.path.join(DATA, "queries.json")
+
+RUN_FILES = ("phrase_search_docids.txt", "vsm_docids.txt", "bm25_docids.txt")
+# Optional files build_index writes next to the required JSON; readers must give the
+# same results with them missing or left over from another build
+SIDECARS = ("index_offsets.json", "bm25.bin", "vsm.bin")
+
+
+def _run(script, *args, **env):
+    """Run one of the task scripts with extra environment settings."""
+    full_env = dict(os.environ, **{k: str(v) for k, v in env.items()})
+    subprocess.run([sys.executable, os.path.join(ROOT, script), *args], check=True,
+                   env=full_env, stdout=subprocess.DEVNULL)
+
+
+def _retrieve(index_dir, out_dir, **env):
+    _run("Task2/phrase_search.py", index_dir, QUERIES, out_dir, "none", **env)
+    _run("Task3/vsm.py", index_dir, QUERIES, out_dir, "none", "10", **env)
+    _run("Task4/bm25_retrieval.py", index_dir, QUERIES, out_dir, "none", "10", **env)
+
+
+class PipelineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix="a2_tests_")
+        cls.vocab_dir = os.path.join(cls.tmp, "vocab")
+        cls.index_dir = os.path.join(cls.tmp, "index")
+        _run("Task0/tokenize_corpus.py", CORPUS, "none", cls.vocab_dir, VOCAB_PROCESSES=1)
+        cls.vocab = os.path.join(cls.vocab_dir, "vocab.txt")
+        _run("Task1/build_index.py", CORPUS, cls.vocab, cls.index_dir, BUILD_PROCESSES=1)
+        cls.out_dir = os.path.join(cls.tmp, "out")
+        _retrieve(cls.index_dir, cls.out_dir, QUERY_PROCESSES=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def assertSameFiles(self, dir_a, dir_b, names):
+        for name in names:
+            with self.subTest(file=name):
+                self.assertTrue(filecmp.cmp(os.path.join(dir_a, name), os.path.join(dir_b, name),
+                                            shallow=False), f"{name} differs")
+
+    def test_parallel_vocab_matches_serial(self):
+        out = os.path.join(self.tmp, "vocab_parallel")
+        _run("Task0/tokenize_corpus.py", CORPUS, "none", out, VOCAB_PROCESSES=3)
+        self.assertSameFiles(self.vocab_dir, out, ["vocab.txt"])
+
+    def test_parallel_index_matches_serial(self):
+        out = os.path.join(self.tmp, "index_parallel")
+        _run("Task1/build_index.py", CORPUS, self.vocab, out, BUILD_PROCESSES=3)
+        self.assertEqual(sorted(os.listdir(out)), sorted(os.listdir(self.index_dir)))
+        self.assertSameFiles(self.index_dir, out, sorted(os.listdir(self.index_dir)))
+
+    def test_bom_line_is_skipped_like_task0(self):
+        # Task 0 reads UTF-8 strictly, so a BOM makes the first line unparseable; the
+        # index must drop that document too, i.e. match a corpus without the line
+        with open(os.path.join(CORPUS, "part0.jsonl"), "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        bom, cut = os.path.join(self.tmp, "corpus_bom"), os.path.join(self.tmp, "corpus_cut")
+        for corpus, data in ((bom, b"\xef\xbb\xbf" + b"".join(lines)), (cut, b"".join(lines[1:]))):
+            os.makedirs(corpus)
+            with open(os.path.join(corpus, "part0.jsonl"), "wb") as f:
+                f.write(data)
+            _run("Task1/build_index.py", corpus, self.vocab, corpus + "_index")
+        self.assertSameFiles(bom + "_index", cut + "_index", ["index.json", "bm25.json", "vsm.json"])
+
+    def test_runs_are_not_empty(self):
+        # Guards the run comparisons against trivially equal empty outputs
+        for name in RUN_FILES:
+            with self.subTest(file=name):
+                self.assertGreater(os.path.getsize(os.path.join(self.out_dir, name)), 0)
+
+    def test_parallel_queries_give_same_runs(self):
+        out = os.path.join(self.tmp, "out_parallel")
+        _retrieve(self.index_dir, out, QUERY_PROCESSES=3)
+        self.assertSameFiles(self.out_dir, out, RUN_FILES)
+
+    def test_json_only_index_gives_same_runs(self):
+        index_dir = os.path.join(self.tmp, "index_json_only")
+        shutil.copytree(self.index_dir, index_dir)
+        for name in SIDECARS:
+            os.remove(os.path.join(index_dir, name))
+        out = os.path.join(self.tmp, "out_json_only")
+        _retrieve(index_dir, out)
+        self.assertSameFiles(self.out_dir, out, RUN_FILES)
+
+    def test_stale_sidecars_are_ignored(self):
+        # An index of a single corpus file, with the full build's sidecars copied in
+        corpus = os.path.join(self.tmp, "corpus_part")
+        os.makedirs(corpus)
+        shutil.copy(os.path.join(CORPUS, "part1.jsonl"), corpus)
+        index_dir = os.path.join(self.tmp, "index_stale")
+        _run("Task1/build_index.py", corpus, self.vocab, index_dir)
+        expected = os.path.join(self.tmp, "out_part")
+        _retrieve(index_dir, expected)
+        for name in SIDECARS:
+            shutil.copy(os.path.join(self.index_dir, name), index_dir)
+        out = os.path.join(self.tmp, "out_stale")
+        _retrieve(index_dir, out)
+        self.assertSameFiles(expected, out, RUN_FILES)
+
+
+if __name__ == "__main__":
+    unittest.main()